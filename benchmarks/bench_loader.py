@@ -0,0 +1,100 @@
+'''Compares database load throughput of the per-row session.get() + session.add()
+path against the BulkLoader on abstracts from the raw abstract cache.
+
+Run from the repository root after populating data/cache:
+    python -m benchmarks.bench_loader --count 300
+'''
+import argparse
+import os
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from build.abstract import AbstractData
+from build.cache import AbstractCache
+from build.loader import BulkLoader
+from build.table import BidTable, BidderTable, ContractTable
+from data.model import Abstract, Base, Bid, Bidder, Contract
+from data.storage import WIDE
+
+
+def build_tables(cache: AbstractCache, count: int) -> list:
+    '''Parses and transforms count cached abstracts without touching the network.'''
+    tables = []
+    for contract_id in sorted(cache.contract_ids())[:count]:
+        abstract_data = AbstractData(contract_id, cache=cache, offline=True)
+        tables.append((
+            contract_id,
+            # The benchmark databases are created with wide storage
+            ContractTable(abstract_data, storage=WIDE),
+            BidTable(abstract_data, storage=WIDE),
+            BidderTable(abstract_data)
+        ))
+    return tables
+
+
+def create_session(path: str, abstract_ids: list):
+    engine = create_engine(f'sqlite+pysqlite:///{path}')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(engine)()
+    for abstract_id in abstract_ids:
+        session.add(Abstract(AbstractID=abstract_id, Processed='NO'))
+    session.commit()
+    return session
+
+
+def load_row_by_row(session, tables: list) -> int:
+    '''The original load path: one SELECT and one ORM object per record and one
+    commit per abstract.'''
+    row_count = 0
+    for abstract_id, contract_table, bid_table, bidder_table in tables:
+        for model, records in ((Contract, contract_table.records),
+                               (Bid, bid_table.records),
+                               (Bidder, bidder_table.records)):
+            key = model.__table__.primary_key.columns.keys()[0]
+            for record in records:
+                if session.get(model, ident=record[key]) is None:
+                    session.add(model(**record))
+                row_count += 1
+        session.query(Abstract).filter(Abstract.AbstractID==abstract_id).update({'Processed': 'YES'})
+        session.commit()
+    return row_count
+
+
+def load_bulk(session, tables: list, batch_size: int) -> int:
+    loader = BulkLoader(session, batch_size=batch_size, storage=WIDE)
+    for abstract_id, contract_table, bid_table, bidder_table in tables:
+        loader.add(abstract_id, contract_table, bid_table, bidder_table)
+    loader.flush()
+    return loader.row_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=300, help='number of cached abstracts to load')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--cache-dir', default='data/cache')
+    args = parser.parse_args()
+
+    tables = build_tables(AbstractCache(args.cache_dir), args.count)
+    abstract_ids = [t[0] for t in tables]
+    print(f'Loaded {len(tables)} abstracts from the cache')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, load in (('bulk', lambda s, t: load_bulk(s, t, args.batch_size)),
+                           ('row-by-row', load_row_by_row)):
+            session = create_session(os.path.join(tmp, f'{name}.sqlite'), abstract_ids)
+            start = time.perf_counter()
+            row_count = load(session, tables)
+            elapsed = time.perf_counter() - start
+            session.close()
+
+            results[name] = row_count / elapsed
+            print(f'{name:>10}: {row_count} rows in {elapsed:.2f} s ({results[name]:,.0f} rows/sec)')
+
+    print(f'Speedup: {results["bulk"] / results["row-by-row"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
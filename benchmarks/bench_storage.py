@@ -0,0 +1,117 @@
+'''Measures query latency of the export join and get_unprocessed_abstract_ids on a
+copy of the database, before and after adding the indexes and tuned pragmas.
+
+Run from the repository root:
+    python -m benchmarks.bench_storage --repeat 5
+'''
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import closing
+import pandas as pd
+from sqlalchemy import inspect, select, text
+from sqlalchemy.orm import Session, undefer_group
+from data.analytics import duckdb_available, read_sql_chunks_duckdb
+from data.model import Base, Bid, Contract, create_db_engine, create_indexes, engine
+from export_weighted_avg_csv import select_bid_totals
+from process_abstracts import get_unprocessed_abstract_ids
+
+
+def export_join(conn):
+    '''The original export query: every bid joined to its contract for one year.'''
+    statement = (
+        select(Bid, Contract.Year, Contract.District, Contract.County).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+        where(Contract.Year==2021).
+        # The wide price columns are deferred on the model
+        options(undefer_group('wide'))
+    )
+    return pd.read_sql(statement, con=conn)
+
+
+def export_grouped(conn):
+    return pd.read_sql(select_bid_totals(), con=conn)
+
+
+def unprocessed_ids(conn):
+    with Session(bind=conn) as session:
+        return get_unprocessed_abstract_ids(session)
+
+
+def time_query(query, conn, repeat: int) -> float:
+    '''Returns the median latency in milliseconds.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query(conn)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def drop_indexes(bench_engine):
+    declared = {index.name for table in Base.metadata.sorted_tables for index in table.indexes}
+    inspector = inspect(bench_engine)
+    with bench_engine.begin() as conn:
+        for table_name in inspector.get_table_names():
+            for index in inspector.get_indexes(table_name):
+                if index['name'] in declared:
+                    conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+
+
+def copy_database(source: str, destination: str):
+    '''Copies a SQLite database with the SQLite backup API, so pages still in its
+    write-ahead log are copied too, and gives the copy the default rollback journal,
+    since journal_mode=WAL is stored in the file.'''
+    with closing(sqlite3.connect(source)) as source_conn, closing(sqlite3.connect(destination)) as copy_conn:
+        source_conn.backup(copy_conn)
+        copy_conn.execute('PRAGMA journal_mode=DELETE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    queries = {
+        'export join (2021)': export_join,
+        'export grouped': export_grouped,
+        'get_unprocessed_abstract_ids': unprocessed_ids
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'db.sqlite')
+        copy_database(engine.url.database, path)
+        url = f'sqlite+pysqlite:///{path}'
+
+        # Baseline: default pragmas and no secondary indexes
+        before_engine = create_db_engine(url, tuned=False)
+        drop_indexes(before_engine)
+        with before_engine.connect() as conn:
+            before = {name: time_query(q, conn, args.repeat) for name, q in queries.items()}
+        before_engine.dispose()
+
+        after_engine = create_db_engine(url)
+        create_indexes(after_engine)
+        with after_engine.connect() as conn:
+            after = {name: time_query(q, conn, args.repeat) for name, q in queries.items()}
+        after_engine.dispose()
+
+        print(f'{"query":<32}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+        for name in queries:
+            print(f'{name:<32}{before[name]:>12.1f}{after[name]:>12.1f}{before[name] / after[name]:>9.1f}x')
+
+        if duckdb_available():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for _chunk in read_sql_chunks_duckdb(select_bid_totals(), 10000, sqlite_path=path):
+                    pass
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f'{"export grouped (duckdb)":<32}{"":>12}{statistics.median(timings):>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
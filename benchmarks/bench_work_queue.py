@@ -0,0 +1,150 @@
+'''Runs several work queue workers as separate processes against one SQLite
+database and the local stub server, then checks every abstract was loaded once.
+
+The queue is seeded with abstracts left claimed by a dead worker (an expired
+lease) and an abstract the server does not have (retried with backoff). Finally an
+abstract whose lease keeps expiring, as if it hung every worker, must end in ERROR.
+
+Run from the repository root:
+    python -m benchmarks.bench_work_queue --workers 4 --count 200
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from benchmarks.corpus import Corpus
+from benchmarks.stub_server import StubServer
+
+
+MISSING_ID = 999999
+HANGING_ID = 999998
+
+
+def run_worker(db_url: str, server_url: str, worker_id: str, batch_size: int):
+    # Set before the project modules create their engine
+    os.environ['MNDOT_DB_URL'] = db_url
+    import build.abstract
+    from build.claims import WorkQueue
+    from data.model import engine, use_immediate_transactions
+    from process_abstracts import process_abstracts
+
+    build.abstract.base_url = f'{server_url}abstractCSV.aspx?ContractId='
+    use_immediate_transactions(engine)
+    process_abstracts(max_workers=2, rate=None, batch_size=batch_size, parse_workers=0,
+                      work_queue=WorkQueue(worker_id, lease_seconds=60))
+
+
+def claim_until_error(max_attempts: int) -> int:
+    '''Seeds an abstract and claims it with leases that have already expired until it
+    is no longer claimable. Returns the number of times it was claimed.'''
+    from build.claims import WorkQueue
+    from build.loader import insert_or_ignore
+    from data.model import Abstract, Session
+
+    with Session() as session:
+        insert_or_ignore(session, Abstract, [{'AbstractID': HANGING_ID, 'Year': 2021, 'Processed': 'NO'}])
+        session.commit()
+
+    work_queue = WorkQueue('hanging-worker', lease_seconds=-1, max_attempts=max_attempts)
+    claims = 0
+    while HANGING_ID in work_queue.claim(1):
+        claims += 1
+        if claims > max_attempts:
+            break
+    return claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--count', type=int, default=200, help='number of synthetic abstracts')
+    parser.add_argument('--items', type=int, default=50, help='items per synthetic abstract')
+    parser.add_argument('--batch-size', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_url = f'sqlite+pysqlite:///{os.path.join(workdir, "db.sqlite")}'
+        os.environ['MNDOT_DB_URL'] = db_url
+        from build.loader import insert_or_ignore
+        from data.model import (Abstract, Base, Bid, BidAggregate, Contract, Item2018, Item2020,
+                                Session, create_indexes, engine)
+        from sqlalchemy import func, select
+
+        corpus = Corpus(count=args.count, items_per_abstract=args.items)
+        Base.metadata.create_all(engine)
+        create_indexes(engine)
+        now = time.time()
+        with Session() as session:
+            insert_or_ignore(session, Item2018, corpus.item_list_rows(2018))
+            insert_or_ignore(session, Item2020, corpus.item_list_rows(2020))
+            abstract_years = [*corpus.years_by_id.items(), (MISSING_ID, 2021)]
+            rows = [{'AbstractID': id, 'Year': year, 'Processed': 'NO', 'ClaimedBy': None,
+                     'ClaimedAt': None, 'LeaseExpires': None} for id, year in abstract_years]
+            # A tenth of the abstracts are held by a worker whose lease has expired
+            for row in rows[:-1:10]:
+                row.update(Processed='CLAIMED', ClaimedBy='dead-worker', ClaimedAt=now - 120,
+                           LeaseExpires=now - 60)
+            insert_or_ignore(session, Abstract, rows)
+            session.commit()
+        engine.dispose()
+
+        context = multiprocessing.get_context('spawn')
+        with StubServer(corpus) as stub:
+            start = time.perf_counter()
+            workers = [
+                context.Process(target=run_worker, args=(db_url, stub.url, f'worker-{i}', args.batch_size))
+                for i in range(args.workers)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+        with Session() as session:
+            status = dict(session.execute(
+                select(Abstract.Processed, func.count()).group_by(Abstract.Processed)).all())
+            claimed_by = dict(session.execute(
+                select(Abstract.ClaimedBy, func.count()).
+                where(Abstract.Processed == 'YES').
+                group_by(Abstract.ClaimedBy)).all())
+            missing = session.get(Abstract, MISSING_ID)
+            contract_count = session.scalar(select(func.count()).select_from(Contract))
+            bid_count = session.scalar(select(func.count()).select_from(Bid))
+            occurrences = session.scalar(
+                select(func.sum(BidAggregate.Occurrences)).where(BidAggregate.BidderCategory == 'Engineer'))
+
+        max_attempts = 3
+        hanging_claims = claim_until_error(max_attempts)
+        with Session() as session:
+            hanging = session.get(Abstract, HANGING_ID)
+
+        expected = len(corpus.contract_ids)
+        print(f'{args.workers} workers loaded {contract_count} abstracts in {elapsed:.1f} s '
+              f'({contract_count / elapsed:.1f} abstracts/sec)')
+        print(f'Status: {status}')
+        print(f'Loaded per worker: {claimed_by}')
+
+        checks = {
+            'every abstract loaded': status.get('YES') == expected and contract_count == expected,
+            'no abstract left claimed': 'CLAIMED' not in status,
+            'bids aggregated once': occurrences == bid_count,
+            'missing abstract backed off': missing.Processed == 'ERROR' and missing.Attempts == 1
+                                           and missing.RetryAfter > now,
+            'expired leases reclaimed': 'dead-worker' not in claimed_by,
+            'repeatedly expiring lease ends in ERROR': hanging_claims == max_attempts
+                                                       and hanging.Processed == 'ERROR'
+                                                       and hanging.Attempts == max_attempts
+        }
+        for name, passed in checks.items():
+            print(f'{"PASS" if passed else "FAIL"}: {name}')
+        engine.dispose()
+
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
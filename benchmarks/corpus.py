@@ -0,0 +1,152 @@
+'''Recorded abstract fixtures plus deterministic, synthetically scaled abstracts
+in the same abstractCSV format.'''
+import glob
+import os
+import random
+from typing import Optional
+
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+DISTRICTS = {
+    'Metro': ['Hennepin', 'Ramsey', 'Anoka', 'Dakota', 'Washington', 'Scott', 'Carver'],
+    'Duluth': ['St. Louis', 'Carlton', 'Lake', 'Cook'],
+    'Rochester': ['Olmsted', 'Winona', 'Mower', 'Freeborn'],
+    'Mankato': ['Blue Earth', 'Nicollet', 'Brown'],
+    'St. Cloud': ['Stearns', 'Benton', 'Sherburne', 'Wright'],
+    'Brainerd': ['Crow Wing', 'Cass', 'Morrison'],
+    'Bemidji': ['Beltrami', 'Clearwater', 'Hubbard'],
+    'Detroit Lakes': ['Becker', 'Clay', 'Otter Tail'],
+}
+
+UNITS = ['LUMP SUM', 'EACH', 'LIN FT', 'SQ FT', 'SQ YD', 'CU YD', 'TON', 'ACRE', 'GALLON']
+
+BID_HEADER = [
+    'Section', 'Line Number', 'ItemNumber', 'Short Description', 'Long Description', 'Unit Name',
+    'Plan Unit Description', 'Quantity', 'Engineers (Unit Price)', 'Engineers (Extended Amount)'
+]
+
+
+def quote(values) -> str:
+    return ','.join(f'"{value}"' for value in values)
+
+
+def recorded_payloads() -> dict[int, bytes]:
+    '''Returns the recorded abstractCSV payloads shipped in fixtures/, keyed by contract ID.'''
+    payloads = {}
+    for path in glob.glob(os.path.join(FIXTURE_DIR, 'abstract_*.csv')):
+        contract_id = int(os.path.basename(path)[len('abstract_'):-len('.csv')])
+        with open(path, 'rb') as f:
+            payloads[contract_id] = f.read()
+    return payloads
+
+
+def item_pool(size: int = 2000, seed: int = 0) -> list[tuple[str, str, str]]:
+    '''Returns size deterministic (item number, description, unit) tuples. Item numbers
+    use the abstract format, e.g. 2021501/00010.'''
+    rng = random.Random(seed)
+    items = set()
+    while len(items) < size:
+        spec_code = rng.randrange(2021, 2600)
+        unit_code = rng.randrange(501, 610)
+        item_code = rng.randrange(10, 99999)
+        items.add(f'{spec_code}{unit_code}/{item_code:05d}')
+
+    return [(number, f'ITEM {number}', rng.choice(UNITS)) for number in sorted(items)]
+
+
+class Corpus:
+    '''A set of abstracts served by the stub server: the recorded fixtures plus
+    count synthetic abstracts of items_per_abstract items each, spread over years.'''
+
+    def __init__(self, count: int = 200, items_per_abstract: int = 150, years: tuple = (2018, 2019, 2020, 2021),
+                 max_bidders: int = 3, item_pool_size: int = 2000, seed: int = 0) -> None:
+        self.items_per_abstract = items_per_abstract
+        self.max_bidders = max_bidders
+        self.seed = seed
+        self.items = item_pool(item_pool_size, seed)
+        self.recorded = recorded_payloads()
+
+        self.years_by_id: dict[int, int] = {}
+        for contract_id, payload in self.recorded.items():
+            letting_date = payload.split(b'\n')[1].split(b',')[1].strip(b'"')
+            self.years_by_id[contract_id] = int(letting_date[-4:])
+        for i in range(count):
+            year = years[i % len(years)]
+            self.years_by_id.setdefault((year % 100) * 100000 + i, year)
+
+
+    @property
+    def contract_ids(self) -> list[int]:
+        return sorted(self.years_by_id)
+
+
+    def ids_for_year(self, year: int) -> list[int]:
+        return [id for id in self.contract_ids if self.years_by_id[id] == year]
+
+
+    def payload(self, contract_id: int) -> Optional[bytes]:
+        '''Returns the recorded payload for a contract ID, a synthetic one, or None if unknown.'''
+        if contract_id in self.recorded:
+            return self.recorded[contract_id]
+        if contract_id in self.years_by_id:
+            return self.synthetic_payload(contract_id)
+        return None
+
+
+    def synthetic_payload(self, contract_id: int) -> bytes:
+        rng = random.Random(self.seed * 1_000_003 + contract_id)
+        year = self.years_by_id[contract_id]
+        district = rng.choice(sorted(DISTRICTS))
+        county = rng.choice(DISTRICTS[district])
+        bidder_count = rng.randint(1, self.max_bidders)
+        bidder_ids = rng.sample(range(1000, 9999), bidder_count)
+
+        lines = [
+            quote(['Contract Id', 'Letting Date', 'SP Number', 'District', 'County', 'Job Description']),
+            quote([contract_id, f'{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{year}',
+                   f'{rng.randint(1000, 9999)}-{rng.randint(1, 200)}', district, county, 'SYNTHETIC']),
+            ''
+        ]
+
+        header = list(BID_HEADER)
+        for i in range(bidder_count):
+            header += [f'Bidder {i + 1} (Unit Price)', f'Bidder {i + 1} (Extended Amount)']
+        lines.append(quote(header))
+
+        totals = [0.0] * bidder_count
+        items = rng.sample(self.items, min(self.items_per_abstract, len(self.items)))
+        for line, (number, description, unit) in enumerate(items, start=1):
+            quantity = 1 if unit == 'LUMP SUM' else rng.randint(1, 5000)
+            engineer = round(rng.lognormvariate(3, 1.2), 2)
+            row = ['1', f'{line * 10:04d}', number, description, description, unit, '',
+                   quantity, f'{engineer:.2f}', f'{engineer * quantity:.2f}']
+            for i in range(bidder_count):
+                price = round(engineer * rng.uniform(0.7, 1.4), 2)
+                totals[i] += price * quantity
+                row += [f'${price:,.2f}', f'${price * quantity:,.2f}']
+            lines.append(quote(row))
+
+        lines.append('')
+        lines.append(quote(['Bidder Number', 'Bidder Name', 'Total Bid']))
+        for bidder_id, total in zip(bidder_ids, totals):
+            lines.append(quote([bidder_id, f'BIDDER {bidder_id}', f'${total:,.2f}']))
+
+        return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+    def item_list_rows(self, year: int) -> list[dict]:
+        '''Returns Item2018 or Item2020 rows for the item pool, as create_database_tables loads them.'''
+        rows = []
+        for number, description, unit in self.items:
+            spec_code, rest = number[:4], number[4:]
+            unit_code, item_code = rest.split('/')
+            rows.append({
+                f'ItemID_{year}': int(number.replace('/', '')),
+                f'SpecCode_{year}': spec_code,
+                f'UnitCode_{year}': unit_code,
+                f'ItemCode_{year}': item_code,
+                f'Description_{year}': description,
+                f'Unit_{year}': unit
+            })
+        return rows
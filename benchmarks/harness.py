@@ -0,0 +1,258 @@
+'''End-to-end benchmark of scrape -> fetch -> parse -> transform -> load -> export
+against a local stub of MnDOT's site, serving recorded fixtures plus synthetic
+abstracts, on a throwaway database.
+
+Run from the repository root:
+    python -m benchmarks.harness --count 500
+    python -m benchmarks.harness --compare benchmarks/results/<commit>.json
+
+Each stage reports its item count, wall time, throughput, p50/p90/p99 latency per
+item and peak RSS. Results are written to benchmarks/results/<commit>.json.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.corpus import Corpus
+from benchmarks.stub_server import StubServer
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def percentile(values: list[float], p: float) -> float:
+    '''Nearest-rank percentile of values, 0 if there are none.'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def reset_peak_rss() -> bool:
+    '''Resets the kernel's peak RSS counter (VmHWM) for this process. Linux only.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    '''Peak RSS since the last reset_peak_rss, or of the whole process if it could not reset.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+class Stage:
+    '''Times one stage of the benchmark, as a context manager, and records the
+    latency of each item processed in it with time().'''
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latencies: list[float] = []
+        self.count = 0
+        self.seconds = 0.0
+        self.peak_rss_mb = 0.0
+
+
+    def time(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        self.count += 1
+        return result
+
+
+    def __enter__(self):
+        reset_peak_rss()
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.seconds = time.perf_counter() - self.start
+        self.peak_rss_mb = peak_rss_mb()
+        print(self.summary())
+
+
+    def result(self) -> dict:
+        latencies_ms = [latency * 1000 for latency in self.latencies]
+        return {
+            'count': self.count,
+            'seconds': round(self.seconds, 4),
+            'throughput': round(self.count / self.seconds, 2) if self.seconds else 0.0,
+            'p50_ms': round(percentile(latencies_ms, 50), 3),
+            'p90_ms': round(percentile(latencies_ms, 90), 3),
+            'p99_ms': round(percentile(latencies_ms, 99), 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1)
+        }
+
+
+    def summary(self) -> str:
+        r = self.result()
+        return (f'{self.name:<10}{r["count"]:>8}{r["seconds"]:>10.2f}{r["throughput"]:>12.1f}'
+                f'{r["p50_ms"]:>10.2f}{r["p90_ms"]:>10.2f}{r["p99_ms"]:>10.2f}{r["peak_rss_mb"]:>10.1f}')
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args, workdir: str) -> dict:
+    # The database location is read at import, so point it at the throwaway
+    # database before importing any project modules
+    os.environ['MNDOT_DB_URL'] = f'sqlite+pysqlite:///{os.path.join(workdir, "db.sqlite")}'
+    import build.abstract
+    from build.abstract import AbstractData, create_http_session, request_raw_abstract_data
+    from build.loader import BulkLoader, insert_or_ignore
+    from build.scraper import AbstractIDRequestScraper
+    from build.table import BidTable, BidderTable, ContractTable
+    from data.model import Abstract, Base, Item2018, Item2020, Session, create_indexes, engine
+    from export_weighted_avg_csv import export_weighted_avg
+
+    corpus = Corpus(count=args.count, items_per_abstract=args.items, seed=args.seed)
+    Base.metadata.create_all(engine)
+    create_indexes(engine)
+    with Session() as session:
+        insert_or_ignore(session, Item2018, corpus.item_list_rows(2018))
+        insert_or_ignore(session, Item2020, corpus.item_list_rows(2020))
+        session.commit()
+
+    print(f'{"stage":<10}{"count":>8}{"seconds":>10}{"items/s":>12}{"p50 ms":>10}{"p90 ms":>10}'
+          f'{"p99 ms":>10}{"rss MB":>10}')
+
+    stages = []
+    with StubServer(corpus, latency=args.latency_ms / 1000) as stub:
+        build.abstract.base_url = f'{stub.url}abstractCSV.aspx?ContractId='
+        years = sorted(set(corpus.years_by_id.values()), reverse=True)
+
+        with Stage('scrape') as stage:
+            scrapers = [stage.time(AbstractIDRequestScraper, year=year, url=f'{stub.url}Abstract.aspx')
+                        for year in years]
+        stages.append(stage)
+
+        abstract_ids = [id for scraper in scrapers for id in scraper.abstract_ids]
+        with Session() as session:
+            insert_or_ignore(session, Abstract, [
+                {'AbstractID': id, 'Year': scraper.year, 'Processed': 'NO'}
+                for scraper in scrapers for id in scraper.abstract_ids
+            ])
+            session.commit()
+
+        with Stage('fetch') as stage:
+            http_session = create_http_session(pool_size=args.workers)
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                raws = list(executor.map(
+                    lambda id: stage.time(request_raw_abstract_data, id, http_session=http_session),
+                    abstract_ids
+                ))
+            http_session.close()
+        stages.append(stage)
+
+    with Stage('parse') as stage:
+        abstracts = [stage.time(AbstractData, raw.contract_id, raw=raw) for raw in raws]
+    stages.append(stage)
+
+    def transform(abstract_data):
+        return (
+            abstract_data.contract_id,
+            ContractTable(abstract_data).batch,
+            BidTable(abstract_data).batch,
+            BidderTable(abstract_data).batch
+        )
+
+    with Stage('transform') as stage:
+        batches = [stage.time(transform, abstract_data) for abstract_data in abstracts]
+    stages.append(stage)
+    del raws, abstracts
+
+    with Stage('load') as stage:
+        with Session() as session:
+            loader = BulkLoader(session, batch_size=args.batch_size)
+            for abstract_batches in batches:
+                stage.time(loader.add_batches, *abstract_batches)
+            loader.flush()
+    stages.append(stage)
+    del batches
+
+    with Stage('export') as stage:
+        stage.time(export_weighted_avg, os.path.join(workdir, 'export.csv'))
+    stages.append(stage)
+
+    return {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'count': args.count,
+            'items': args.items,
+            'abstracts': len(abstract_ids),
+            'workers': args.workers,
+            'batch_size': args.batch_size,
+            'latency_ms': args.latency_ms,
+            'seed': args.seed
+        },
+        'stages': {stage.name: stage.result() for stage in stages}
+    }
+
+
+def compare(result: dict, baseline: dict):
+    '''Prints the throughput change of each stage relative to a baseline result.'''
+    print(f'\nThroughput vs {baseline.get("commit", "baseline")}:')
+    for name, stage in result['stages'].items():
+        before = baseline['stages'].get(name, {}).get('throughput')
+        if not before:
+            continue
+        change = (stage['throughput'] - before) / before * 100
+        print(f'{name:<10}{before:>12.1f}{stage["throughput"]:>12.1f}{change:>+9.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200, help='number of synthetic abstracts')
+    parser.add_argument('--items', type=int, default=150, help='items per synthetic abstract')
+    parser.add_argument('--workers', type=int, default=8, help='fetch threads')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every stub response')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='a previous results file to compare throughput against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = run(args, workdir)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{result["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'Wrote {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
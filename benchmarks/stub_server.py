@@ -0,0 +1,173 @@
+'''Local HTTP stand-in for MnDOT's PostLetting web app that serves a Corpus.
+
+Serves the Abstract.aspx list page (including the letting year and page size
+postbacks) and abstractCSV.aspx payloads. Run standalone with:
+    python -m benchmarks.stub_server --port 8000
+'''
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+from benchmarks.corpus import Corpus, FIXTURE_DIR
+
+
+def read_template(name: str) -> Template:
+    with open(os.path.join(FIXTURE_DIR, name)) as f:
+        return Template(f.read())
+
+
+PAGE_TEMPLATE = read_template('Abstract.aspx.html')
+GRID_TEMPLATE = read_template('grid.html')
+DEFAULT_PAGE_SIZE = 10
+SELECTED = ' selected="selected"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+    @property
+    def corpus(self) -> Corpus:
+        return self.server.corpus
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.endswith('/Abstract.aspx'):
+            self.send_page(year=None, page_size=None)
+        elif url.path.endswith('/abstractCSV.aspx'):
+            query = {k.lower(): v for k, v in parse_qs(url.query).items()}
+            contract_id = query.get('contractid', [''])[0]
+            payload = self.corpus.payload(int(contract_id)) if contract_id.isdigit() else None
+            if payload is None:
+                self.send_body(b'Not found', 'text/plain', status=404)
+            else:
+                self.send_body(payload, 'text/csv; charset=utf-8')
+        else:
+            self.send_body(b'Not found', 'text/plain', status=404)
+
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode(), keep_blank_values=True).items()}
+
+        # Like ASP.NET, reject postbacks that do not carry back the page state
+        if form.get('__EVENTVALIDATION') != self.server.event_validation:
+            self.send_body(b'Invalid postback or callback argument', 'text/plain', status=500)
+            return
+
+        year = int(form.get('ctl00$MainContent$drpLettingYear') or self.server.years[0])
+        page_size = None
+        if form.get('__EVENTTARGET') == 'ctl00$MainContent$drpPage':
+            page_size = int(form.get('ctl00$MainContent$drpPage') or DEFAULT_PAGE_SIZE)
+        self.send_page(year=year, page_size=page_size or DEFAULT_PAGE_SIZE)
+
+
+    def send_page(self, year, page_size):
+        year_options = '\n'.join(
+            f'    <option{SELECTED if y == year else ""} value="{y}">{y}</option>'
+            for y in self.server.years
+        )
+
+        grid = ''
+        if year is not None:
+            rows = []
+            for contract_id in self.corpus.ids_for_year(year)[:page_size]:
+                rows.append(
+                    f'    <tr><td>{year}</td><td>{contract_id}</td>'
+                    f'<td><a href="abstractCSV.aspx?ContractId={contract_id}">Download CSV</a></td></tr>'
+                )
+            page_options = '\n'.join(
+                f'    <option{SELECTED if size == page_size else ""} value="{size}">'
+                f'{"All" if size == 20000 else size}</option>'
+                for size in (10, 50, 100, 20000)
+            )
+            grid = GRID_TEMPLATE.substitute(page_options=page_options, rows='\n'.join(rows))
+
+        page = PAGE_TEMPLATE.substitute(
+            viewstate=self.server.view_state,
+            eventvalidation=self.server.event_validation,
+            year_options=year_options,
+            grid=grid
+        )
+        self.send_body(page.encode('utf-8'), 'text/html; charset=utf-8')
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+    def handle_error(self, request, client_address):
+        # Clients closing idle keep-alive connections are expected, not errors
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    '''Runs a StubHandler server on a background thread, as a context manager.'''
+
+    def __init__(self, corpus: Corpus, host: str = '127.0.0.1', port: int = 0, latency: float = 0) -> None:
+        self.server = QuietHTTPServer((host, port), StubHandler)
+        self.server.corpus = corpus
+        self.server.latency = latency
+        self.server.years = sorted(set(corpus.years_by_id.values()), reverse=True)
+        token = hashlib.sha256(repr(corpus.contract_ids).encode()).hexdigest()
+        self.server.view_state = token[:32]
+        self.server.event_validation = token[32:]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/PostLetting/'
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a benchmark corpus like MnDOT\'s PostLetting site.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--count', type=int, default=200, help='number of synthetic abstracts')
+    parser.add_argument('--items', type=int, default=150, help='items per synthetic abstract')
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every response')
+    args = parser.parse_args()
+
+    corpus = Corpus(count=args.count, items_per_abstract=args.items)
+    with StubServer(corpus, port=args.port, latency=args.latency_ms / 1000) as stub:
+        print(f'Serving {len(corpus.contract_ids)} abstracts at {stub.url}Abstract.aspx')
+        try:
+            stub.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
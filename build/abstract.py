@@ -1,18 +1,73 @@
+import functools
 import requests
-import re
-from io import StringIO
+import threading
+import time
+from io import BytesIO
+from typing import Optional
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from build.cache import AbstractCache, CacheEntry
+from build.metrics import metrics
+from build.parser import CHUNK_SIZE, SubtableSplitter, iter_file_chunks
 
 
 base_url = 'http://transport.dot.state.mn.us/PostLetting/abstractCSV.aspx?ContractId='
 
+# Position of the first bidder price column in the bid subtable
+FIRST_BIDDER_COLUMN = 10
+
+
+def create_http_session(pool_size: int = 10, retries: int = 3) -> requests.Session:
+    '''Creates a keep-alive session with a connection pool large enough to be
+    shared by pool_size concurrent threads.'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class RateLimiter:
+    '''Thread safe limiter that spaces calls to wait() at least 1/rate seconds apart.
+    A rate of None or 0 disables limiting.'''
+
+    def __init__(self, rate: Optional[float] = None) -> None:
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class RequestAbstractData:
     '''Context manager for retrieving and streaming web hosted bid abstract data into the AbstractData class.'''
 
-    def __init__(self, contract_id: int) -> None:
+    def __init__(self, contract_id: int, http_session: Optional[requests.Session] = None,
+                 rate_limiter: Optional[RateLimiter] = None, timeout: float = 60,
+                 cache: Optional[AbstractCache] = None, offline: bool = False,
+                 refresh: bool = False) -> None:
         self.contract_id = contract_id
         self.url = base_url + str(contract_id)
+        self.http_session = http_session
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        # Cached payloads are read before the network unless refresh is set.
+        # Offline mode never touches the network.
+        self.cache = cache
+        self.offline = offline
+        self.refresh = refresh
+        self.cache_entry: Optional[CacheEntry] = None
+        self.encoding = 'utf-8'
+        self.changed = True
 
 
     def __enter__(self):
@@ -25,52 +80,179 @@ class RequestAbstractData:
 
 
     def request_data(self):
-        '''Requests data from web app and splits into subtables bytestrings.'''
+        '''Streams data from the cache or web app, splitting it into subtable bytestrings
+        as it arrives.'''
+        splitter = SubtableSplitter()
+        cached = None
+        if self.cache and not self.refresh:
+            cached = self.cache.open(self.contract_id)
+
+        if cached:
+            metrics.inc('cache_hits_total')
+            f, self.cache_entry = cached
+            with f:
+                for chunk in iter_file_chunks(f):
+                    splitter.feed(chunk)
+            self.encoding = self.cache_entry.encoding
+            self.changed = not self.cache_entry.parsed
+        elif self.offline:
+            raise SystemExit(f'Abstract {self.contract_id} is not cached and offline mode is set')
+        else:
+            self.fetch(splitter)
+
+        self.contract_bytestr, self.bid_bytestr, self.bidder_bytestr = splitter.close()
+
+
+    def fetch(self, splitter: SubtableSplitter):
+        '''Streams data from the web app into splitter, storing the raw payload in the
+        cache if one is set.'''
+        chunks = []
         try:
-            self.response = requests.get(self.url)
-            # Raise a RequestException if there is an error with the response
-            self.response.raise_for_status()
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            # Reuse the pooled keep-alive connection when a session is provided
+            http = self.http_session or requests
+            with metrics.timer('fetch_seconds'):
+                self.response = http.get(self.url, timeout=self.timeout, stream=True)
+                # Retries made by the session's adapter are recorded on the raw response
+                retries = getattr(self.response.raw, 'retries', None)
+                if retries and retries.history:
+                    metrics.inc('fetch_retries_total', len(retries.history))
+                # Raise a RequestException if there is an error with the response
+                self.response.raise_for_status()
 
-            # Split the response data by blank lines to divide into its three subtables
-            blank_line_regex = r"(?:\r?\n){2,}"
-            self.contract_bytestr, self.bid_bytestr, self.bidder_bytestr = re.split(
-                blank_line_regex, self.response.text)
+                for chunk in self.response.iter_content(CHUNK_SIZE):
+                    splitter.feed(chunk)
+                    metrics.inc('bytes_fetched_total', len(chunk))
+                    # The cache needs the whole payload to hash it
+                    if self.cache:
+                        chunks.append(chunk)
 
         except requests.exceptions.RequestException as e:
+            metrics.inc('http_errors_total')
             raise SystemExit(e)
 
+        self.encoding = self.response.encoding or 'utf-8'
+        if self.cache:
+            self.cache_entry, changed = self.cache.put(
+                self.contract_id, b''.join(chunks), self.encoding)
+            self.changed = changed or not self.cache_entry.parsed
+
 
     def stream_contract_data(self):
         '''Streams contract data for loading into pandas.read_csv() function.'''
-        return StringIO(self.contract_bytestr)
+        return BytesIO(self.contract_bytestr)
 
 
     def stream_bid_data(self):
         '''Streams contract data for loading into pandas.read_csv() function.'''
-        return StringIO(self.bid_bytestr)
+        return BytesIO(self.bid_bytestr)
 
 
     def stream_bidder_data(self):
         '''Streams contract data for loading into pandas.read_csv() function.'''
-        return StringIO(self.bidder_bytestr)
+        return BytesIO(self.bidder_bytestr)
+
+
+class RawAbstractData:
+    '''Picklable subtable bytestrings of a fetched abstract, so parsing can happen in
+    another process from the one that made the request.'''
+
+    def __init__(self, contract_id: int, contract_bytestr: bytes, bid_bytestr: bytes,
+                 bidder_bytestr: bytes, encoding: str = 'utf-8', content_hash: Optional[str] = None,
+                 changed: bool = True) -> None:
+        self.contract_id = contract_id
+        self.encoding = encoding
+        self.contract_bytestr = contract_bytestr
+        self.bid_bytestr = bid_bytestr
+        self.bidder_bytestr = bidder_bytestr
+        self.content_hash = content_hash
+        self.changed = changed
+
+
+    @classmethod
+    def from_request(cls, request: RequestAbstractData):
+        return cls(
+            request.contract_id,
+            request.contract_bytestr,
+            request.bid_bytestr,
+            request.bidder_bytestr,
+            encoding=request.encoding,
+            content_hash=request.cache_entry.sha256 if request.cache_entry else None,
+            changed=request.changed
+        )
+
+
+    def stream_contract_data(self):
+        return BytesIO(self.contract_bytestr)
+
+
+    def stream_bid_data(self):
+        return BytesIO(self.bid_bytestr)
+
+
+    def stream_bidder_data(self):
+        return BytesIO(self.bidder_bytestr)
+
+
+def request_raw_abstract_data(contract_id: int, **kwargs) -> RawAbstractData:
+    '''Retrieves an abstract from the cache or web without parsing it. Keyword
+    arguments are passed to RequestAbstractData.'''
+    with RequestAbstractData(contract_id, **kwargs) as ab:
+        return RawAbstractData.from_request(ab)
 
 
 class AbstractData:
     '''Serves input data to Table classes.'''
 
-    def __init__(self, contract_id: int) -> None:
+    def __init__(self, contract_id: int, http_session: Optional[requests.Session] = None,
+                 rate_limiter: Optional[RateLimiter] = None, cache: Optional[AbstractCache] = None,
+                 offline: bool = False, refresh: bool = False,
+                 raw: Optional[RawAbstractData] = None) -> None:
         self.contract_id = contract_id
 
-        # Retrieve data from the web and load into dataframes
-        with RequestAbstractData(self.contract_id) as ab:
-            self.contract_data = pd.read_csv(ab.stream_contract_data())
-            self.bid_data = pd.read_csv(ab.stream_bid_data())
-            self.bidder_data = pd.read_csv(ab.stream_bidder_data())
+        # Retrieve data from the cache or web unless it was already fetched
+        if raw is None:
+            raw = request_raw_abstract_data(
+                self.contract_id, http_session=http_session, rate_limiter=rate_limiter,
+                cache=cache, offline=offline, refresh=refresh
+            )
+        self.content_hash = raw.content_hash
+
+        # A refreshed payload identical to the one already loaded is not re-parsed
+        self.changed = raw.changed
+        if refresh and not self.changed:
+            return
+
+        # Load the subtables into dataframes
+        with metrics.timer('parse_seconds'):
+            self.contract_data = pd.read_csv(raw.stream_contract_data(), encoding=raw.encoding)
+            self.bid_data = pd.read_csv(raw.stream_bid_data(), encoding=raw.encoding)
+            self.bidder_data = pd.read_csv(raw.stream_bidder_data(), encoding=raw.encoding)
+
+
+    @functools.cached_property
+    def bidder_price_columns(self) -> list[tuple[str, str]]:
+        '''The (unit price, extended amount) bid columns of each bidder in rank order,
+        found by their "Bidder n" headers or else taken in pairs after the engineer's
+        estimate columns.'''
+        columns = list(self.bid_data.columns)
+        price_columns = []
+        while True:
+            n = len(price_columns) + 1
+            pair = (f'Bidder {n} (Unit Price)', f'Bidder {n} (Extended Amount)')
+            if pair[0] not in columns or pair[1] not in columns:
+                break
+            price_columns.append(pair)
 
+        if not price_columns:
+            bidder_columns = columns[FIRST_BIDDER_COLUMN:]
+            price_columns = list(zip(bidder_columns[0::2], bidder_columns[1::2]))
+        return price_columns
 
     @property
     def bidder_count(self):
-        return int((len(self.bid_data.columns) - 10) / 2)
+        return len(self.bidder_price_columns)
 
     @property
     def bidder_id_0(self):
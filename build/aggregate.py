@@ -0,0 +1,130 @@
+from typing import Optional
+from sqlalchemy import delete, func, literal, select, true
+from sqlalchemy.dialects.sqlite import insert
+from data.model import Base, Bid, BidAggregate, BidPrice, Contract, Session, engine
+from data.storage import LONG, WIDE, WIDE_RANKS, get_bid_storage
+
+
+BIDDER_CATEGORIES = ['Engineer', 'BidderID_0', 'BidderID_1', 'BidderID_2']
+
+# BidPrice rank of each bidder category
+CATEGORY_RANKS = {category: rank for rank, category in WIDE_RANKS.items()}
+
+
+def select_bid_totals(bidder_category: str, contract_ids: Optional[list[int]] = None,
+                      sign: int = 1):
+    '''Returns a select of the price and quantity sums and bid counts of a bidder
+    category grouped by item, year and location. Restricted to contract_ids if given.
+    A sign of -1 negates the totals so they can be subtracted from the aggregates.'''
+    total_price = getattr(Bid, bidder_category + '_TotalPrice')
+    district = func.coalesce(Contract.District, '')
+    county = func.coalesce(Contract.County, '')
+
+    if contract_ids is None:
+        contract_filter = true()
+    else:
+        contract_filter = Bid.ContractID.in_(contract_ids)
+
+    return (
+        select(
+            Bid.ItemID,
+            Contract.Year,
+            literal(bidder_category),
+            district,
+            county,
+            sign * func.sum(total_price),
+            sign * func.sum(Bid.Quantity),
+            sign * func.count(total_price)
+        ).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+        # The WHERE clause is required by SQLite to parse INSERT ... SELECT ... ON CONFLICT
+        where(contract_filter, total_price.is_not(None)).
+        group_by(Bid.ItemID, Contract.Year, district, county)
+    )
+
+
+def select_bid_price_totals(bidder_category: str, contract_ids: Optional[list[int]] = None,
+                            sign: int = 1):
+    '''Returns the same select as select_bid_totals for long bid storage, reading the
+    bidder category's prices from the BidPrice table by (BidID, Rank).'''
+    district = func.coalesce(Contract.District, '')
+    county = func.coalesce(Contract.County, '')
+
+    if contract_ids is None:
+        contract_filter = true()
+    else:
+        contract_filter = Bid.ContractID.in_(contract_ids)
+
+    return (
+        select(
+            Bid.ItemID,
+            Contract.Year,
+            literal(bidder_category),
+            district,
+            county,
+            sign * func.sum(BidPrice.TotalPriceCents) / 100.0,
+            sign * func.sum(Bid.Quantity),
+            sign * func.count()
+        ).
+        join(BidPrice, onclause=(BidPrice.BidID==Bid.BidID) &
+                                (BidPrice.Rank==CATEGORY_RANKS[bidder_category])).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+        where(contract_filter).
+        group_by(Bid.ItemID, Contract.Year, district, county)
+    )
+
+
+def upsert_bid_totals(session: Session, contract_ids: Optional[list[int]] = None, sign: int = 1,
+                      storage: str = WIDE):
+    '''Adds (or with sign=-1 subtracts) the bids of contract_ids to the running totals.'''
+    select_totals = select_bid_price_totals if storage == LONG else select_bid_totals
+    columns = [
+        'ItemID', 'Year', 'BidderCategory', 'District', 'County',
+        'TotalPriceSum', 'QuantitySum', 'Occurrences'
+    ]
+    for bidder_category in BIDDER_CATEGORIES:
+        statement = insert(BidAggregate).from_select(
+            columns, select_totals(bidder_category, contract_ids, sign)
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['ItemID', 'Year', 'BidderCategory', 'District', 'County'],
+            set_={
+                'TotalPriceSum': BidAggregate.TotalPriceSum + statement.excluded.TotalPriceSum,
+                'QuantitySum': BidAggregate.QuantitySum + statement.excluded.QuantitySum,
+                'Occurrences': BidAggregate.Occurrences + statement.excluded.Occurrences
+            }
+        )
+        session.execute(statement)
+
+    if sign < 0:
+        session.execute(delete(BidAggregate).where(BidAggregate.Occurrences <= 0))
+
+
+def add_contracts(session: Session, contract_ids: list[int], storage: str = WIDE):
+    '''Adds the bids of newly loaded contracts to the aggregate tables.'''
+    if contract_ids:
+        upsert_bid_totals(session, contract_ids, sign=1, storage=storage)
+
+
+def remove_contracts(session: Session, contract_ids: list[int], storage: str = WIDE):
+    '''Subtracts the bids of contracts that are about to be deleted from the aggregate tables.'''
+    if contract_ids:
+        upsert_bid_totals(session, contract_ids, sign=-1, storage=storage)
+
+
+def rebuild_aggregates(session: Session):
+    '''Recomputes the aggregate tables from every bid in the database.'''
+    session.execute(delete(BidAggregate))
+    upsert_bid_totals(session, storage=get_bid_storage(session.connection()))
+
+
+def main():
+    # Creates the aggregate table if needed and rebuilds it from the Bid table
+    Base.metadata.create_all(engine, tables=[BidAggregate.__table__])
+    with Session() as session:
+        rebuild_aggregates(session)
+        session.commit()
+
+
+if __name__ == '__main__':
+    main()
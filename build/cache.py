@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterator, Optional
+
+
+CACHE_DIR = 'data/cache'
+
+
+class CacheEntry:
+    '''Metadata describing the cached payload of a single abstract.'''
+
+    def __init__(self, contract_id: int, sha256: str, fetched_at: str,
+                 encoding: str, parsed_sha256: Optional[str] = None) -> None:
+        self.contract_id = contract_id
+        self.sha256 = sha256
+        self.fetched_at = fetched_at
+        self.encoding = encoding
+        self.parsed_sha256 = parsed_sha256
+
+
+    @property
+    def parsed(self) -> bool:
+        '''True if the current payload has already been loaded into the database.'''
+        return self.parsed_sha256 == self.sha256
+
+
+    def __repr__(self) -> str:
+        return f'CacheEntry(contract_id={self.contract_id}, sha256={self.sha256}, fetched_at={self.fetched_at})'
+
+
+class AbstractCache:
+    '''Content addressed, gzip compressed store of raw abstractCSV payloads.
+
+    Payloads are stored once per unique sha256 under objects/ and each contract
+    ID has a small JSON index file under index/ pointing at its current payload.'''
+
+    def __init__(self, cache_dir: str = CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+        self.object_dir = os.path.join(cache_dir, 'objects')
+        self.index_dir = os.path.join(cache_dir, 'index')
+        os.makedirs(self.object_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.object_dir, sha256[:2], sha256 + '.gz')
+
+
+    def index_path(self, contract_id: int) -> str:
+        return os.path.join(self.index_dir, f'{contract_id}.json')
+
+
+    def get_entry(self, contract_id: int) -> Optional[CacheEntry]:
+        '''Returns the cache entry for a contract ID or None if it has not been cached.'''
+        try:
+            with open(self.index_path(contract_id)) as f:
+                return CacheEntry(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+
+    def get(self, contract_id: int) -> Optional[tuple[bytes, CacheEntry]]:
+        '''Returns the raw payload and its entry, or None on a cache miss.'''
+        entry = self.get_entry(contract_id)
+        if entry is None:
+            return None
+        try:
+            with gzip.open(self.object_path(entry.sha256), 'rb') as f:
+                return f.read(), entry
+        except FileNotFoundError:
+            return None
+
+
+    def open(self, contract_id: int) -> Optional[tuple[BinaryIO, CacheEntry]]:
+        '''Returns a binary file object streaming the decompressed payload and its
+        entry, or None on a cache miss. The caller closes the file.'''
+        entry = self.get_entry(contract_id)
+        if entry is None:
+            return None
+        try:
+            return gzip.open(self.object_path(entry.sha256), 'rb'), entry
+        except FileNotFoundError:
+            return None
+
+
+    def put(self, contract_id: int, payload: bytes, encoding: str) -> tuple[CacheEntry, bool]:
+        '''Stores a payload and returns its entry and whether the content changed
+        from the previously cached payload.'''
+        sha256 = hashlib.sha256(payload).hexdigest()
+        previous = self.get_entry(contract_id)
+
+        path = self.object_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Temporary files are per process since queue workers may share a cache
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+        entry = CacheEntry(
+            contract_id=contract_id,
+            sha256=sha256,
+            fetched_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            encoding=encoding,
+            parsed_sha256=previous.parsed_sha256 if previous else None
+        )
+        self.write_entry(entry)
+
+        changed = previous is None or previous.sha256 != sha256
+        return entry, changed
+
+
+    def mark_parsed(self, contract_id: int):
+        '''Records that the currently cached payload has been loaded into the database.'''
+        entry = self.get_entry(contract_id)
+        if entry is not None:
+            entry.parsed_sha256 = entry.sha256
+            self.write_entry(entry)
+
+
+    def write_entry(self, entry: CacheEntry):
+        path = self.index_path(entry.contract_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(vars(entry), f)
+        os.replace(tmp_path, path)
+
+
+    def contract_ids(self) -> Iterator[int]:
+        '''Yields every contract ID with a cached payload.'''
+        for filename in os.listdir(self.index_dir):
+            if filename.endswith('.json'):
+                yield int(filename[:-5])
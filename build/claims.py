@@ -0,0 +1,130 @@
+import os
+import socket
+import time
+from typing import Optional
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.orm import Session as SessionType
+from data.model import Abstract, Session
+
+
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 5
+# Errored abstracts wait BACKOFF_BASE * 2^(attempts - 1) seconds, up to BACKOFF_MAX
+BACKOFF_BASE = 60
+BACKOFF_MAX = 6 * 3600
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def retry_delay(attempts: int, base: float = BACKOFF_BASE, maximum: float = BACKOFF_MAX) -> float:
+    '''Seconds an abstract that has failed attempts times waits before it is retried.'''
+    return min(maximum, base * 2 ** max(attempts - 1, 0))
+
+
+def lease_expired(now: float):
+    return and_(Abstract.Processed == 'CLAIMED', Abstract.LeaseExpires < now)
+
+
+def claimable(now: float, max_attempts: int = MAX_ATTEMPTS):
+    '''Abstracts that are unprocessed, held by an expired lease with attempts left,
+    or errored and due for a retry.'''
+    return or_(
+        Abstract.Processed == 'NO',
+        and_(lease_expired(now), func.coalesce(Abstract.Attempts, 0) + 1 < max_attempts),
+        and_(
+            Abstract.Processed == 'ERROR',
+            func.coalesce(Abstract.Attempts, 0) < max_attempts,
+            func.coalesce(Abstract.RetryAfter, 0) <= now
+        )
+    )
+
+
+def mark_errors(session: SessionType, abstract_ids: list[int]):
+    '''Marks abstracts as ERROR, counting the attempt and scheduling the next retry
+    with exponential backoff.'''
+    now = time.time()
+    statement = select(Abstract.AbstractID, Abstract.Attempts).where(Abstract.AbstractID.in_(abstract_ids))
+    for abstract_id, attempts in session.execute(statement).all():
+        attempts = (attempts or 0) + 1
+        session.execute(
+            update(Abstract).
+            where(Abstract.AbstractID == abstract_id).
+            values(Processed='ERROR', Attempts=attempts, RetryAfter=now + retry_delay(attempts),
+                   LeaseExpires=None)
+        )
+
+
+class WorkQueue:
+    '''Hands out batches of abstracts to workers sharing one database.
+
+    claim() leases up to count claimable abstracts to this worker with a single
+    UPDATE, so concurrent workers never receive the same abstract. A worker that
+    dies keeps its abstracts only until its lease expires, when they become
+    claimable again. Loading an abstract twice after a lease expired is harmless
+    since the loader skips contracts already in the database.
+
+    An expired lease counts as a failed attempt, so an abstract that kills or hangs
+    every worker becomes an ERROR after max_attempts leases instead of being
+    reclaimed forever.'''
+
+    def __init__(self, worker_id: Optional[str] = None, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS) -> None:
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.claimed_count = 0
+
+
+    def claim(self, count: int) -> list[int]:
+        '''Leases up to count abstracts to this worker and returns their IDs.'''
+        now = time.time()
+        attempts = func.coalesce(Abstract.Attempts, 0) + 1
+        exhausted = (
+            update(Abstract).
+            where(lease_expired(now), attempts >= self.max_attempts).
+            values(Processed='ERROR', Attempts=attempts, LeaseExpires=None).
+            execution_options(synchronize_session=False)
+        )
+        candidates = (
+            select(Abstract.AbstractID).
+            where(claimable(now, self.max_attempts)).
+            order_by(Abstract.AbstractID).
+            limit(count)
+        )
+        statement = (
+            update(Abstract).
+            # Rechecked on the claimed rows for databases that evaluate the subquery first
+            where(Abstract.AbstractID.in_(candidates), claimable(now, self.max_attempts)).
+            values(Processed='CLAIMED', ClaimedBy=self.worker_id, ClaimedAt=now,
+                   LeaseExpires=now + self.lease_seconds,
+                   Attempts=case((lease_expired(now), attempts), else_=Abstract.Attempts)).
+            execution_options(synchronize_session=False)
+        )
+        claimed = (
+            select(Abstract.AbstractID).
+            where(Abstract.ClaimedBy == self.worker_id, Abstract.ClaimedAt == now,
+                  Abstract.Processed == 'CLAIMED')
+        )
+        with Session() as session:
+            session.execute(exhausted)
+            session.execute(statement)
+            abstract_ids = list(session.execute(claimed).scalars())
+            session.commit()
+
+        self.claimed_count += len(abstract_ids)
+        return abstract_ids
+
+
+    def release(self):
+        '''Returns abstracts this worker still holds to the queue, e.g. on interruption.'''
+        statement = (
+            update(Abstract).
+            where(Abstract.ClaimedBy == self.worker_id, Abstract.Processed == 'CLAIMED').
+            values(Processed='NO', LeaseExpires=None).
+            execution_options(synchronize_session=False)
+        )
+        with Session() as session:
+            session.execute(statement)
+            session.commit()
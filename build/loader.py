@@ -0,0 +1,199 @@
+import numpy as np
+from typing import Optional
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from build.aggregate import add_contracts, remove_contracts
+from build.claims import mark_errors
+from build.metrics import metrics
+from build.table import BidPriceTable, BidTable, BidderTable, ContractBidderTable, ContractTable
+from data.model import Abstract, Base, Bid, Bidder, BidPrice, Contract, ContractBidder
+from data.prices import price_index
+from data.storage import LONG, get_bid_storage
+
+
+def insert_or_ignore(session: Session, model: Base, rows: list[dict]):
+    '''Inserts rows with a single set-based INSERT OR IGNORE (ON CONFLICT DO NOTHING)
+    so existing primary keys are skipped without a SELECT per row.'''
+    if rows:
+        statement = insert(model.__table__).on_conflict_do_nothing()
+        session.execute(statement, rows)
+
+
+def insert_batch_or_ignore(session: Session, model: Base, batch: np.ndarray):
+    '''Inserts a batch (a structured array from the table classes) like insert_or_ignore,
+    handing its rows to the driver as tuples so no dictionary is built per row.
+    Float NaN is bound as NULL by SQLite.'''
+    if len(batch):
+        connection = session.connection()
+        statement = insert(model.__table__).on_conflict_do_nothing()
+        compiled = statement.compile(dialect=connection.dialect, column_keys=list(batch.dtype.names))
+        rows = batch[list(compiled.positiontup)].tolist()
+        connection.exec_driver_sql(str(compiled), rows)
+
+
+class BulkLoader:
+    '''Accumulates table rows from many abstracts and loads them in batches.
+
+    Abstracts are queued as columnar batches, which are concatenated per table so
+    each flush inserts every pending row with one INSERT OR IGNORE per table,
+    adds the new bids to the BidAggregate running totals, marks the batch's
+    abstracts as processed, commits and clears the session
+    so memory stays flat over long runs. If a batch fails, its abstracts are
+    retried one at a time so a single bad abstract only marks itself as ERROR.
+
+    With long bid storage the BidPrice and ContractBidder batches are loaded too.
+    storage is read from the database when not given.'''
+
+    # Insert order satisfies the foreign keys from Contract and Bid
+    models = (Bidder, Contract, ContractBidder, Bid, BidPrice)
+
+    def __init__(self, session: Session, batch_size: int = 50, replace: bool = False,
+                 storage: Optional[str] = None) -> None:
+        self.session = session
+        self.batch_size = batch_size
+        # Replace deletes previously loaded Contract and Bid rows before inserting
+        self.replace = replace
+        self._storage = storage
+        self.pending: dict[int, dict] = {}
+        self.row_count = 0
+
+
+    @property
+    def storage(self) -> str:
+        if self._storage is None:
+            self._storage = get_bid_storage(self.session.connection())
+        return self._storage
+
+
+    def add(self, abstract_id: int, contract_table: ContractTable, bid_table: BidTable,
+            bidder_table: BidderTable) -> list[int]:
+        '''Queues an abstract's rows. Returns the IDs committed if the batch was flushed.
+        Contract and Bid tables transformed for another storage mode are transformed
+        again, since their columns differ.'''
+        if contract_table.storage != self.storage:
+            contract_table = ContractTable(contract_table.input_data, storage=self.storage)
+        if bid_table.storage != self.storage:
+            bid_table = BidTable(bid_table.input_data, storage=self.storage)
+        long_batches = ()
+        if self.storage == LONG:
+            long_batches = (BidPriceTable(bid_table.input_data).batch,
+                            ContractBidderTable(bidder_table.input_data).batch)
+        return self.add_batches(abstract_id, contract_table.batch, bid_table.batch,
+                                bidder_table.batch, *long_batches)
+
+
+    def add_batches(self, abstract_id: int, contract_batch: np.ndarray, bid_batch: np.ndarray,
+                    bidder_batch: np.ndarray, bid_price_batch: Optional[np.ndarray] = None,
+                    contract_bidder_batch: Optional[np.ndarray] = None) -> list[int]:
+        '''Queues an abstract's rows from the batches produced by the table classes.
+        Long bid storage also needs the BidPrice and ContractBidder batches.'''
+        if self.storage == LONG and bid_price_batch is None:
+            raise ValueError('Long bid storage needs the BidPrice and ContractBidder batches')
+
+        self.pending[abstract_id] = {
+            Bidder: bidder_batch,
+            Contract: contract_batch,
+            Bid: bid_batch
+        }
+        if self.storage == LONG:
+            self.pending[abstract_id][BidPrice] = bid_price_batch
+            self.pending[abstract_id][ContractBidder] = contract_bidder_batch
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+
+    def flush(self) -> list[int]:
+        '''Loads all pending abstracts and returns the IDs that were committed.'''
+        if not self.pending:
+            return []
+
+        batch = self.pending
+        self.pending = {}
+        try:
+            with metrics.timer('load_seconds'):
+                row_counts = self.load(batch)
+                self.session.commit()
+            self.count_rows(row_counts)
+            loaded = list(batch)
+        except Exception as error:
+            print(f'Batch load failed, retrying individually: {error.__class__}: {error}')
+            metrics.inc('batch_retries_total')
+            self.session.rollback()
+            loaded = []
+            for abstract_id, rows in batch.items():
+                try:
+                    row_counts = self.load({abstract_id: rows})
+                    self.session.commit()
+                    self.count_rows(row_counts)
+                    loaded.append(abstract_id)
+                except Exception as error:
+                    print(f'{abstract_id}: {error.__class__}: {error}')
+                    metrics.inc('errors_total', stage='load')
+                    metrics.event('abstract_error', abstract_id=abstract_id, stage='load', error=repr(error))
+                    self.session.rollback()
+                    self.set_processed([abstract_id], 'ERROR')
+                    self.session.commit()
+
+        self.session.expunge_all()
+        return loaded
+
+
+    def count_rows(self, row_counts: dict[str, int]):
+        '''Counts the rows of a committed batch.'''
+        for table, row_count in row_counts.items():
+            self.row_count += row_count
+            metrics.inc('rows_inserted_total', row_count, table=table)
+        # New bids change the aggregates behind cached price lookups
+        price_index.invalidate()
+
+
+    def load(self, batch: dict[int, dict]) -> dict[str, int]:
+        '''Inserts the rows of a batch of abstracts and returns the number of rows per table.'''
+        abstract_ids = list(batch)
+        statement = select(Contract.ContractID).where(Contract.ContractID.in_(abstract_ids))
+        existing_ids = list(self.session.execute(statement).scalars())
+
+        # Contracts already in the database are either replaced or left untouched
+        # so their bids are never counted twice in the aggregates
+        if self.replace:
+            remove_contracts(self.session, existing_ids, storage=self.storage)
+            if self.storage == LONG:
+                bid_ids = select(Bid.BidID).where(Bid.ContractID.in_(existing_ids))
+                self.session.execute(delete(BidPrice).where(BidPrice.BidID.in_(bid_ids)))
+                self.session.execute(
+                    delete(ContractBidder).where(ContractBidder.ContractID.in_(existing_ids)))
+            self.session.execute(delete(Bid).where(Bid.ContractID.in_(existing_ids)))
+            self.session.execute(delete(Contract).where(Contract.ContractID.in_(existing_ids)))
+            new_ids = abstract_ids
+        else:
+            new_ids = [id for id in abstract_ids if id not in existing_ids]
+
+        row_counts = {}
+        for model in self.models:
+            # BidPrice and ContractBidder are only queued with long storage
+            queued = [tables[model] for tables in batch.values() if model in tables]
+            if not queued:
+                continue
+            rows = np.concatenate(queued)
+            insert_batch_or_ignore(self.session, model, rows)
+            row_counts[model.__tablename__] = len(rows)
+
+        add_contracts(self.session, new_ids, storage=self.storage)
+        self.set_processed(abstract_ids, 'YES')
+        return row_counts
+
+
+    def set_processed(self, abstract_ids: list[int], processed: str):
+        '''Sets Processed for abstracts. ERROR also schedules a retry with backoff for
+        work queue mode.'''
+        if processed == 'ERROR':
+            mark_errors(self.session, abstract_ids)
+            return
+        statement = (
+            update(Abstract).
+            where(Abstract.AbstractID.in_(abstract_ids)).
+            values(Processed=processed, LeaseExpires=None)
+        )
+        self.session.execute(statement)
@@ -0,0 +1,243 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from typing import Optional, TextIO
+
+
+# Upper bounds in seconds, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    '''Cumulative bucket counts, sum and count of observed values.'''
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+    def merge(self, counts: list, sum: float, count: int):
+        for i, bucket_count in enumerate(counts):
+            self.counts[i] += bucket_count
+        self.sum += sum
+        self.count += count
+
+
+class NullTimer:
+    '''Timer returned while metrics are disabled, so timing costs one attribute check.'''
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    '''Observes the seconds spent inside the with block in a histogram.'''
+
+    def __init__(self, metrics, name: str, labels: dict) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+    '''Registry of counters and timing histograms for a processing run.
+
+    Disabled by default, in which case inc(), observe() and event() return
+    immediately and timer() returns a shared no-op context manager. enable()
+    starts collecting and optionally writes JSON log lines to log_file ("-" for
+    stdout) and the Prometheus text format to prometheus_file on write().'''
+
+    def __init__(self, namespace: str = 'mndot') -> None:
+        self.namespace = namespace
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        self.log: Optional[TextIO] = None
+        self.prometheus_file: Optional[str] = None
+
+
+    def enable(self, log_file: Optional[str] = None, prometheus_file: Optional[str] = None):
+        if log_file == '-':
+            self.log = sys.stdout
+        elif log_file:
+            self.log = open(log_file, 'a', buffering=1)
+        self.prometheus_file = prometheus_file
+        self.enabled = True
+
+
+    def disable(self):
+        self.enabled = False
+        if self.log not in (None, sys.stdout):
+            self.log.close()
+        self.log = None
+
+
+    def inc(self, name: str, value: float = 1, **labels):
+        '''Adds value to the counter name, e.g. inc('rows_inserted_total', 50, table='Bid').'''
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def observe(self, name: str, value: float, **labels):
+        '''Records value in the histogram name.'''
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+
+    def timer(self, name: str, **labels):
+        '''Context manager observing the duration of its block in the histogram name.'''
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+
+    def event(self, event: str, **fields):
+        '''Writes a structured JSON log line if a log file is set.'''
+        if not self.enabled or self.log is None:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str)
+        with self.lock:
+            self.log.write(line + '\n')
+
+
+    def drain(self) -> dict:
+        '''Returns and clears everything collected, for merging into another
+        process's registry with merge().'''
+        with self.lock:
+            snapshot = {
+                'counters': self.counters,
+                'histograms': {key: (h.counts, h.sum, h.count) for key, h in self.histograms.items()}
+            }
+            self.counters = {}
+            self.histograms = {}
+        return snapshot
+
+
+    def merge(self, snapshot: Optional[dict]):
+        if not self.enabled or not snapshot:
+            return
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, state in snapshot['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(*state)
+
+
+    def render_prometheus(self) -> str:
+        '''Renders all metrics in the Prometheus text exposition format.'''
+        def format_labels(labels, extra=()):
+            pairs = [f'{k}="{v}"' for k, v in (*labels, *extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+
+            typed = set()
+            for (name, labels), value in counters:
+                metric = f'{self.namespace}_{name}'
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} counter')
+                    typed.add(metric)
+                lines.append(f'{metric}{format_labels(labels)} {value:g}')
+
+            for (name, labels), histogram in histograms:
+                metric = f'{self.namespace}_{name}'
+                if metric not in typed:
+                    lines.append(f'# TYPE {metric} histogram')
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{metric}_sum{format_labels(labels)} {histogram.sum:.6f}')
+                lines.append(f'{metric}_count{format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+    def write(self):
+        '''Writes the Prometheus text file, if set, atomically so a node exporter
+        textfile collector never reads a partial file.'''
+        if not self.enabled or not self.prometheus_file:
+            return
+        tmp_file = f'{self.prometheus_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_file, self.prometheus_file)
+
+
+class PipelineStats:
+    '''Counts of abstracts handled by a pipeline run. Kept here rather than with the
+    pipeline so callers can report on a run without importing pandas.'''
+
+    def __init__(self) -> None:
+        self.fetched = 0
+        self.processed = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.rows = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+
+    @property
+    def rate(self) -> float:
+        total = self.processed + self.unchanged + self.errors
+        return total / self.elapsed if self.elapsed else 0.0
+
+
+    def __str__(self) -> str:
+        return (f'Processed {self.processed} abstracts ({self.unchanged} unchanged, {self.errors} errors, '
+                f'{self.rows} rows) in {self.elapsed:.1f} s ({self.rate:.2f} abstracts/sec)')
+
+
+# Process wide registry imported by the instrumented modules
+metrics = Metrics()
+
+
+def enable_collection():
+    '''Enables collection without any output. Used as the initializer of parse
+    worker processes, whose metrics are drained back to the parent.'''
+    metrics.enable()
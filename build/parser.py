@@ -0,0 +1,126 @@
+from typing import Iterable
+
+
+# Column names that identify the header line of each abstractCSV subtable
+SUBTABLE_HEADERS = {
+    'contract': b'Contract Id',
+    'bid': b'ItemNumber',
+    'bidder': b'Bidder Number'
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class MissingSubtableError(ValueError):
+    pass
+
+
+def is_header_line(line: bytes, column: bytes) -> bool:
+    '''True if column is one of the (optionally quoted) fields of a csv line.'''
+    return any(field.strip().strip(b'"') == column for field in line.split(b','))
+
+
+def ends_in_quotes(data: bytes, start: int, end: int, in_quotes: bool = False) -> bool:
+    '''True if the csv line data[start:end] ends inside a quoted field, i.e. the field
+    continues on the next line. A quote only opens a field at its start and only closes
+    it before a comma or the end of the line, and a doubled quote is an escaped quote.
+    Any other quote, e.g. an inch mark, is part of the field.'''
+    position = data.find(b'"', start, end)
+    while position != -1:
+        following = data[position + 1:position + 2]
+        if not in_quotes:
+            in_quotes = position == start or data[position - 1:position] == b','
+        elif following == b'"':
+            position += 1
+        elif following in (b',', b'\r', b'\n', b''):
+            in_quotes = False
+        position = data.find(b'"', position + 1, end)
+    return in_quotes
+
+
+class SubtableSplitter:
+    '''Splits an abstractCSV payload fed in chunks of bytes into its contract, bid
+    and bidder subtables without decoding it or holding more than one partial line
+    besides the subtables themselves.
+
+    Each subtable starts at the line containing its header rather than after a
+    fixed number of blank lines, so payloads with extra blank lines, or none
+    between two subtables, split the same way. Blank lines and quoted fields
+    spanning several lines are handled. Quotes inside a field, such as the inch
+    mark in 4" SOLID LINE, are taken literally as pandas does.'''
+
+    def __init__(self) -> None:
+        self.subtables = {name: bytearray() for name in SUBTABLE_HEADERS}
+        # Headers still to be found, so each line is only searched for those
+        self.remaining = dict(SUBTABLE_HEADERS)
+        self.current = None
+        self.carry = b''
+        self.in_quotes = False
+
+
+    def feed(self, chunk: bytes):
+        start = 0
+        if self.carry:
+            # Complete the partial line left by the previous chunk, copying only that line
+            end = chunk.find(b'\n')
+            if end == -1:
+                self.carry += chunk
+                return
+            line = self.carry + chunk[:end + 1]
+            self.carry = b''
+            self.add_line(line, memoryview(line), 0, len(line))
+            start = end + 1
+
+        view = memoryview(chunk)
+        while True:
+            end = chunk.find(b'\n', start)
+            if end == -1:
+                break
+            self.add_line(chunk, view, start, end + 1)
+            start = end + 1
+        self.carry = chunk[start:]
+
+
+    def add_line(self, data: bytes, view: memoryview, start: int, end: int):
+        '''Adds data[start:end] to the current subtable, starting a new one at a header.'''
+        if not self.in_quotes:
+            if end - start <= 2 and not data[start:end].strip():
+                return
+            for name, column in self.remaining.items():
+                if data.find(column, start, end) != -1 and is_header_line(data[start:end], column):
+                    del self.remaining[name]
+                    self.current = self.subtables[name]
+                    break
+
+        if self.current is not None:
+            self.current.extend(view[start:end])
+        # Most lines are only quoted fields, "a","b,c", and end outside quotes: every quote
+        # between the first and last is then part of a "," separator. Any other line,
+        # such as one with an inch mark, is walked quote by quote
+        last = end - 3 if data[end - 2] == 13 else end - 2
+        if (self.in_quotes or last <= start or data[start] != 34 or data[last] != 34
+                or data.count(b'"', start + 1, last) != 2 * data.count(b'","', start + 1, last)):
+            self.in_quotes = ends_in_quotes(data, start, end, self.in_quotes)
+
+
+    def close(self) -> tuple[bytes, bytes, bytes]:
+        '''Returns the contract, bid and bidder subtables once the payload has been fed.'''
+        if self.carry:
+            data, self.carry = self.carry + b'\n', b''
+            self.add_line(data, memoryview(data), 0, len(data))
+        if self.remaining:
+            raise MissingSubtableError(f'Abstract is missing its {", ".join(self.remaining)} subtable')
+        return tuple(bytes(self.subtables[name]) for name in SUBTABLE_HEADERS)
+
+
+def split_subtables(chunks: Iterable[bytes]) -> tuple[bytes, bytes, bytes]:
+    '''Splits an iterable of payload chunks into its contract, bid and bidder subtables.'''
+    splitter = SubtableSplitter()
+    for chunk in chunks:
+        splitter.feed(chunk)
+    return splitter.close()
+
+
+def iter_file_chunks(f, chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    '''Yields chunks read from a binary file object.'''
+    return iter(lambda: f.read(chunk_size), b'')
@@ -0,0 +1,274 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from build.abstract import AbstractData, RateLimiter, RawAbstractData, create_http_session, request_raw_abstract_data
+from build.cache import AbstractCache
+from build.claims import WorkQueue
+from build.loader import BulkLoader
+from build.metrics import PipelineStats, enable_collection, metrics
+from build.table import BidPriceTable, BidTable, BidderTable, ContractBidderTable, ContractTable
+from data.model import Session, engine
+from data.storage import LONG, WIDE, get_bid_storage
+
+
+def transform_abstract(raw: RawAbstractData, storage: str = WIDE) -> tuple[tuple[np.ndarray, ...], Optional[dict]]:
+    '''Parses a fetched abstract and returns its Contract, Bid and Bidder batches,
+    followed by its BidPrice and ContractBidder batches for long bid storage.
+    Runs in a parse worker process, so any metrics it collected are drained and
+    returned with the batches for the parent to merge.'''
+    abstract_data = AbstractData(raw.contract_id, raw=raw)
+    batches = (
+        ContractTable(abstract_data, storage=storage).batch,
+        BidTable(abstract_data, storage=storage).batch,
+        BidderTable(abstract_data).batch
+    )
+    if storage == LONG:
+        batches += (BidPriceTable(abstract_data).batch, ContractBidderTable(abstract_data).batch)
+    in_worker = multiprocessing.parent_process() is not None
+    return batches, metrics.drain() if in_worker and metrics.enabled else None
+
+
+class Pipeline:
+    '''Runs fetch -> parse -> load as concurrent stages connected by bounded queues.
+
+    - fetch: fetch_workers threads download (or read cached) raw abstracts
+    - parse: parse_workers processes turn raw abstracts into columnar table batches
+    - load: the calling thread is the only database writer, bulk loading batches
+
+    A full queue blocks the stage feeding it, so neither downloads nor parsed
+    batches pile up in memory. Abstract.Processed is the checkpoint: it is set to
+    YES in the same commit as each batch's rows, so an interrupted run loses at
+    most one batch and resumes from the abstracts still marked NO.'''
+
+    def __init__(self, fetch_workers: int = 8, parse_workers: Optional[int] = None,
+                 queue_size: int = 32, batch_size: int = 50, rate: Optional[float] = 4.0,
+                 cache: Optional[AbstractCache] = None, offline: bool = False,
+                 refresh: bool = False) -> None:
+        self.fetch_workers = fetch_workers
+        # 0 parse workers parses on a thread in this process instead
+        self.parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.rate = rate
+        self.cache = cache
+        self.offline = offline
+        self.refresh = refresh
+        # Bid storage mode of the database, read at the start of each run
+        self.storage = WIDE
+        self.stop = threading.Event()
+
+
+    def put(self, q: queue.Queue, item) -> bool:
+        '''Blocks until item is queued, giving up if the pipeline is stopped.'''
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+    def get(self, q: queue.Queue):
+        '''Blocks until an item is available, returning None if the pipeline is stopped.'''
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return None
+
+
+    def fetch_stage(self, ids: queue.Queue, fetched: queue.Queue, stats: PipelineStats,
+                    work_queue: Optional[WorkQueue] = None):
+        http_session = create_http_session(pool_size=self.fetch_workers)
+        rate_limiter = RateLimiter(self.rate)
+        claim_lock = threading.Lock()
+        # The fetch threads share the fetched count
+        stats_lock = threading.Lock()
+
+        def next_id():
+            '''Returns the next ID to fetch, claiming another batch from the work
+            queue when the IDs run out, or None when there is no more work.'''
+            while True:
+                try:
+                    return ids.get_nowait()
+                except queue.Empty:
+                    if work_queue is None:
+                        return None
+                with claim_lock:
+                    if ids.empty():
+                        claimed = work_queue.claim(self.batch_size)
+                        if not claimed:
+                            return None
+                        for abstract_id in claimed:
+                            ids.put(abstract_id)
+
+        def fetch_worker():
+            try:
+                while not self.stop.is_set():
+                    abstract_id = next_id()
+                    if abstract_id is None:
+                        break
+                    try:
+                        result = request_raw_abstract_data(
+                            abstract_id, http_session=http_session, rate_limiter=rate_limiter,
+                            cache=self.cache, offline=self.offline, refresh=self.refresh
+                        )
+                        with stats_lock:
+                            stats.fetched += 1
+                    except BaseException as error:
+                        result = error
+                    if not self.put(fetched, (abstract_id, result)):
+                        return
+            except Exception as error:
+                # A failed claim ends this fetcher rather than the run
+                print(f'Fetch worker stopped: {error.__class__}: {error}')
+            self.put(fetched, None)
+
+        threads = [threading.Thread(target=fetch_worker, daemon=True) for _ in range(self.fetch_workers)]
+        for thread in threads:
+            thread.start()
+        return threads, http_session
+
+
+    def parse_stage(self, executor, fetched: queue.Queue, parsed: queue.Queue,
+                    parse_slots: threading.Semaphore):
+        '''Submits fetched abstracts to the parse executor, holding at most queue_size
+        parses in flight. Errors and unchanged abstracts pass straight through.'''
+        remaining_fetchers = self.fetch_workers
+        try:
+            while remaining_fetchers:
+                item = self.get(fetched)
+                if self.stop.is_set():
+                    return
+                if item is None:
+                    remaining_fetchers -= 1
+                    continue
+
+                abstract_id, result = item
+                if isinstance(result, RawAbstractData) and (result.changed or not self.refresh):
+                    while not parse_slots.acquire(timeout=0.5):
+                        if self.stop.is_set():
+                            return
+                    result = executor.submit(transform_abstract, result, self.storage)
+                parsed.put((abstract_id, result))
+        finally:
+            # Always tell the writer there is nothing more to load
+            parsed.put(None)
+
+
+    def run(self, abstract_ids: list[int], work_queue: Optional[WorkQueue] = None) -> PipelineStats:
+        '''Processes abstract_ids, then batches claimed from work_queue if one is given
+        until it has no more claimable abstracts.'''
+        stats = PipelineStats()
+        self.stop.clear()
+        with engine.connect() as conn:
+            self.storage = get_bid_storage(conn)
+
+        ids = queue.Queue()
+        for abstract_id in abstract_ids:
+            ids.put(abstract_id)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        parsed = queue.Queue()
+        parse_slots = threading.Semaphore(self.queue_size)
+
+        if self.parse_workers:
+            # Spawned rather than forked since the fetch threads are already running
+            # Workers only collect metrics when this process does
+            executor = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                           mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=enable_collection if metrics.enabled else None)
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+
+        fetch_threads, http_session = self.fetch_stage(ids, fetched, stats, work_queue)
+        dispatcher = threading.Thread(
+            target=self.parse_stage, args=(executor, fetched, parsed, parse_slots), daemon=True
+        )
+        dispatcher.start()
+
+        try:
+            self.load_stage(parsed, parse_slots, stats)
+        except KeyboardInterrupt:
+            print('Interrupted, committed batches are kept. Re-run to resume.')
+            raise
+        finally:
+            self.stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            for thread in fetch_threads:
+                thread.join()
+            http_session.close()
+            stats.elapsed = time.perf_counter() - stats.start
+            metrics.event('run_complete', processed=stats.processed, unchanged=stats.unchanged,
+                          errors=stats.errors, rows=stats.rows, seconds=round(stats.elapsed, 3))
+            metrics.write()
+
+        return stats
+
+
+    def load_stage(self, parsed: queue.Queue, parse_slots: threading.Semaphore, stats: PipelineStats):
+        '''Loads parsed batches in arrival order as the single database writer.'''
+        with Session() as session:
+            loader = BulkLoader(session, batch_size=self.batch_size, replace=self.refresh,
+                                storage=self.storage)
+            queued_count = 0
+
+            def mark_loaded(loaded_ids: list):
+                stats.processed += len(loaded_ids)
+                stats.rows = loader.row_count
+                if self.cache:
+                    for loaded_id in loaded_ids:
+                        self.cache.mark_parsed(loaded_id)
+                if loaded_ids:
+                    print(f'Loaded {stats.processed} abstracts ({stats.rows} rows)')
+                    metrics.event('batch_loaded', abstracts=len(loaded_ids), processed=stats.processed,
+                                  rows=stats.rows)
+                    metrics.write()
+
+            try:
+                while True:
+                    item = parsed.get()
+                    if item is None:
+                        break
+
+                    abstract_id, result = item
+                    try:
+                        if isinstance(result, Future):
+                            try:
+                                batches, worker_metrics = result.result()
+                                metrics.merge(worker_metrics)
+                            finally:
+                                parse_slots.release()
+                        elif isinstance(result, RawAbstractData):
+                            stats.unchanged += 1
+                            metrics.inc('unchanged_total')
+                            continue
+                        else:
+                            raise result
+
+                    except BaseException as error:
+                        if isinstance(error, KeyboardInterrupt):
+                            raise
+                        print(f'{abstract_id}: {error.__class__}: {error}')
+                        stage = 'parse' if isinstance(result, Future) else 'fetch'
+                        metrics.inc('errors_total', stage=stage)
+                        metrics.event('abstract_error', abstract_id=abstract_id, stage=stage,
+                                      error=repr(error))
+                        loader.set_processed([abstract_id], 'ERROR')
+                        session.commit()
+                        stats.errors += 1
+                        continue
+
+                    queued_count += 1
+                    mark_loaded(loader.add_batches(abstract_id, *batches))
+
+            finally:
+                # Commit whatever was fully parsed, including on interruption
+                mark_loaded(loader.flush())
+                stats.errors += queued_count - stats.processed
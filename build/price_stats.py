@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, Optional
+from build.aggregate import BIDDER_CATEGORIES
+
+
+GROUP_KEYS = ['ItemID', 'Year', 'BidderCategory']
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+DEFAULT_TRIM = 0.1
+
+
+def melt_bids(bid_df: pd.DataFrame) -> pd.DataFrame:
+    '''Reshapes bids with one price column pair per bidder category into long form,
+    one row per (bid, bidder category) with a price. bid_df needs ItemID, Year,
+    Quantity and the <category>_UnitPrice and _TotalPrice columns.'''
+    n = len(bid_df)
+    unit_prices = np.column_stack(
+        [bid_df[f'{c}_UnitPrice'].to_numpy(dtype='float64') for c in BIDDER_CATEGORIES]).ravel()
+    total_prices = np.column_stack(
+        [bid_df[f'{c}_TotalPrice'].to_numpy(dtype='float64') for c in BIDDER_CATEGORIES]).ravel()
+    has_price = ~np.isnan(total_prices)
+
+    categories = pd.Categorical.from_codes(
+        np.tile(np.arange(len(BIDDER_CATEGORIES)), n)[has_price], categories=BIDDER_CATEGORIES)
+    return pd.DataFrame({
+        'ItemID': np.repeat(bid_df['ItemID'].to_numpy(dtype='int64'), len(BIDDER_CATEGORIES))[has_price],
+        'Year': np.repeat(bid_df['Year'].to_numpy(dtype='int64'), len(BIDDER_CATEGORIES))[has_price],
+        'BidderCategory': categories,
+        'Quantity': np.repeat(bid_df['Quantity'].to_numpy(dtype='float64'), len(BIDDER_CATEGORIES))[has_price],
+        'UnitPrice': unit_prices[has_price],
+        'TotalPrice': total_prices[has_price]
+    })
+
+
+def percentile_column(percentile: float) -> str:
+    return f'P{percentile:g}UnitPrice'
+
+
+def statistic_columns(percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+                      order_statistics: bool = True) -> list[str]:
+    '''Returns the statistic names computed by aggregate_bid_stats, in output order.'''
+    if not order_statistics:
+        return ['ContractOccurrence', 'WeightedUnitPrice']
+    return (['ContractOccurrence', 'WeightedUnitPrice', 'MedianUnitPrice'] +
+            [percentile_column(p) for p in percentiles] + ['TrimmedMeanUnitPrice'])
+
+
+def group_codes(long_df: pd.DataFrame) -> tuple[np.ndarray, pd.MultiIndex]:
+    '''Returns the (ItemID, Year, BidderCategory) group number of each row, numbered in
+    key order, and the group keys. Hashes one combined integer key instead of grouping
+    on three columns.'''
+    item_codes, item_ids = pd.factorize(long_df['ItemID'], sort=True)
+    year_codes, years = pd.factorize(long_df['Year'], sort=True)
+    category_codes = long_df['BidderCategory'].cat.codes.to_numpy()
+    year_count, category_count = len(years), len(BIDDER_CATEGORIES)
+
+    combined = (item_codes.astype('int64') * year_count + year_codes) * category_count + category_codes
+    codes, combined_keys = pd.factorize(combined, sort=True)
+    keys = pd.MultiIndex.from_arrays([
+        item_ids[combined_keys // (year_count * category_count)],
+        years[combined_keys // category_count % year_count],
+        pd.Categorical.from_codes(combined_keys % category_count, categories=BIDDER_CATEGORIES)
+    ], names=GROUP_KEYS)
+    return codes, keys
+
+
+def aggregate_bid_stats(long_df: pd.DataFrame, percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+                        trim: float = DEFAULT_TRIM, order_statistics: bool = True) -> pd.DataFrame:
+    '''Computes every statistic of the unit prices of each (ItemID, Year, BidderCategory)
+    group of melt_bids output in one pass: a single sort by group and unit price, then
+    vectorized reads of the sorted groups.
+
+    - ContractOccurrence: number of bids
+    - WeightedUnitPrice: total price / total quantity
+    - MedianUnitPrice and P<n>UnitPrice: linearly interpolated percentiles
+    - TrimmedMeanUnitPrice: mean after dropping the lowest and highest trim
+      fraction of bids, which damps outliers such as mobilization-loaded prices
+
+    With order_statistics False only the first two are computed and nothing is sorted.'''
+    percentiles = tuple(percentiles)
+    columns = statistic_columns(percentiles, order_statistics)
+    if long_df.empty:
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_arrays([[], [], []], names=GROUP_KEYS))
+
+    codes, keys = group_codes(long_df)
+    group_count = len(keys)
+
+    counts = np.bincount(codes, minlength=group_count)
+    total_price = np.bincount(codes, weights=long_df['TotalPrice'].to_numpy(), minlength=group_count)
+    quantity = np.bincount(codes, weights=long_df['Quantity'].to_numpy(), minlength=group_count)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weighted = total_price / quantity
+    stats = {
+        'ContractOccurrence': counts,
+        'WeightedUnitPrice': weighted
+    }
+    if order_statistics:
+        stats.update(order_stats(long_df['UnitPrice'].to_numpy(dtype='float64'), codes, counts,
+                                 percentiles, trim))
+
+    stats_df = pd.DataFrame(stats, index=keys)
+    price_columns = columns[1:]
+    stats_df[price_columns] = stats_df[price_columns].round(2)
+    return stats_df
+
+
+def order_stats(unit_prices: np.ndarray, codes: np.ndarray, counts: np.ndarray,
+                percentiles: tuple, trim: float) -> dict[str, np.ndarray]:
+    '''Returns the median, percentiles and trimmed mean of unit prices per group.'''
+    group_count = len(counts)
+    # Sort by unit price, then stably by group, so each group's prices are contiguous
+    # and ascending. Missing unit prices sort last in their group and are excluded
+    order = np.argsort(unit_prices, kind='stable')
+    order = order[np.argsort(codes[order], kind='stable')]
+    sorted_prices = unit_prices[order]
+    sorted_codes = codes[order]
+    valid = ~np.isnan(sorted_prices)
+    sizes = np.bincount(sorted_codes[valid], minlength=group_count)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    def group_percentile(q: float) -> np.ndarray:
+        position = starts + q * np.maximum(sizes - 1, 0)
+        low = np.floor(position).astype('int64')
+        high = np.ceil(position).astype('int64')
+        # Empty groups read a valid index and are masked below
+        low = np.minimum(low, len(sorted_prices) - 1)
+        high = np.minimum(high, len(sorted_prices) - 1)
+        values = sorted_prices[low] + (sorted_prices[high] - sorted_prices[low]) * (position - low)
+        return np.where(sizes > 0, values, np.nan)
+
+    # Trimmed mean from prefix sums over each group's kept middle slice
+    cumulative = np.concatenate(([0.0], np.cumsum(np.where(valid, sorted_prices, 0.0))))
+    cut = np.floor(sizes * trim).astype('int64')
+    kept = sizes - 2 * cut
+    kept_sum = cumulative[starts + sizes - cut] - cumulative[starts + cut]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trimmed_mean = np.where(kept > 0, kept_sum / kept, np.nan)
+
+    stats = {'MedianUnitPrice': group_percentile(0.5)}
+    for p in percentiles:
+        stats[percentile_column(p)] = group_percentile(p / 100)
+    stats['TrimmedMeanUnitPrice'] = trimmed_mean
+    return stats
+
+
+def wide_columns(years: Iterable[int], stats: Iterable[str]) -> list[str]:
+    '''Returns <year>_<bidder category>_<statistic> column names in year, category order.'''
+    return [f'{year}_{bidder}_{stat}' for year in years for bidder in BIDDER_CATEGORIES for stat in stats]
+
+
+def pivot_stats(stats_df: pd.DataFrame, years: Optional[Iterable[int]] = None,
+                stats: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    '''Pivots aggregate_bid_stats output into one row per ItemID with a
+    <year>_<bidder category>_<statistic> column per combination.'''
+    stats = list(stats if stats is not None else stats_df.columns)
+    if years is None:
+        years = sorted(stats_df.index.get_level_values('Year').unique().tolist(), reverse=True)
+    columns = wide_columns(years, stats)
+    if stats_df.empty:
+        return pd.DataFrame(columns=columns, dtype='float64')
+
+    wide = stats_df[stats].unstack(['Year', 'BidderCategory'])
+    wide.columns = [f'{year}_{bidder}_{stat}' for stat, year, bidder in wide.columns]
+    return wide.reindex(columns=columns).astype('float64')
@@ -1,7 +1,20 @@
-from selenium.webdriver import Firefox
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support.ui import Select
-from typing import List
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from typing import List, Optional
+from urllib.parse import parse_qs, urljoin, urlparse
+
+
+abstract_list_url = 'http://transport.dot.state.mn.us/PostLetting/Abstract.aspx'
+
+
+def extract_contract_id(link: str) -> Optional[int]:
+    '''Returns the ContractId query parameter of an abstract download link, or None.'''
+    query = parse_qs(urlparse(link).query)
+    for key, values in query.items():
+        if key.lower() == 'contractid' and values and values[0].strip().isdigit():
+            return int(values[0])
+    return None
 
 
 class AbstractIDScraper:
@@ -9,12 +22,16 @@ class AbstractIDScraper:
     def __init__(self, year: int = 2021, headless: bool = True) -> None:
         self.year = year
         self.headless = headless
-        self.url = 'http://transport.dot.state.mn.us/PostLetting/Abstract.aspx'
+        self.url = abstract_list_url
         self.browser = self.get_browser()
         self.abstract_ids: List[int] = self.get_abstract_id_list()
 
 
     def get_browser(self):
+        # Selenium is only required for this browser based scraper
+        from selenium.webdriver import Firefox
+        from selenium.webdriver.firefox.options import Options
+
         if self.headless == True:
             opts = Options()
             opts.headless = True
@@ -27,6 +44,8 @@ class AbstractIDScraper:
 
     def get_abstract_id_list(self):
         '''Scrapes list of abstract IDs from webpage.'''
+        from selenium.webdriver.support.ui import Select
+
         # Select letting year
         element = self.browser.find_element_by_id('MainContent_drpLettingYear')
         select = Select(element)
@@ -48,12 +67,150 @@ class AbstractIDScraper:
         # Extract contract IDs from the download links
         contract_ids = list()
         for row in all_rows:
-            link = row.get_attribute('href')
-            if 'ContractId' in link:
-                contract_ids.append(int(link[-6:]))
+            contract_id = extract_contract_id(row.get_attribute('href') or '')
+            if contract_id is not None:
+                contract_ids.append(contract_id)
 
         return contract_ids
 
 
     def __del__(self):
-        self.browser.close()
\ No newline at end of file
+        browser = getattr(self, 'browser', None)
+        if browser is not None:
+            browser.close()
+
+
+class AbstractPageParser(HTMLParser):
+    '''Collects the ASP.NET form state and the abstract grid links from an Abstract.aspx page.'''
+
+    def __init__(self, grid_id: str = 'MainContent_gvabstractMenu') -> None:
+        super().__init__(convert_charrefs=True)
+        self.grid_id = grid_id
+        self.fields: dict[str, str] = {}
+        self.buttons: dict[str, str] = {}
+        self.names_by_id: dict[str, str] = {}
+        self.links: list[str] = []
+        self.select_name: Optional[str] = None
+        self.select_has_option = False
+        self.grid_depth = 0
+
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get('name')
+        if name and attrs.get('id'):
+            self.names_by_id[attrs['id']] = name
+
+        if tag == 'input' and name:
+            # Buttons are only submitted when clicked and unchecked boxes never are
+            input_type = (attrs.get('type') or 'text').lower()
+            if input_type in ('submit', 'button', 'image', 'reset'):
+                self.buttons[name] = attrs.get('value') or ''
+                return
+            if input_type in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.fields[name] = attrs.get('value') or ''
+
+        elif tag == 'select' and name:
+            self.select_name = name
+            self.select_has_option = False
+            self.fields[name] = ''
+
+        elif tag == 'option' and self.select_name:
+            # The first option is the default unless another one is selected
+            if 'selected' in attrs or not self.select_has_option:
+                self.fields[self.select_name] = attrs.get('value') or ''
+            self.select_has_option = True
+
+        elif tag == 'table' and (self.grid_depth or attrs.get('id') == self.grid_id):
+            self.grid_depth += 1
+
+        elif tag == 'a' and self.grid_depth and attrs.get('href'):
+            self.links.append(attrs['href'])
+
+
+    def handle_endtag(self, tag):
+        if tag == 'select':
+            self.select_name = None
+        elif tag == 'table' and self.grid_depth:
+            self.grid_depth -= 1
+
+
+def parse_abstract_page(html: str) -> AbstractPageParser:
+    parser = AbstractPageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+class AbstractIDRequestScraper:
+    '''Retrieves a list of abstract IDs from MnDOT's hosting site without a browser by
+    replaying the ASP.NET form posts (__VIEWSTATE/__EVENTVALIDATION) the page makes.'''
+
+    def __init__(self, year: int = 2021, url: str = abstract_list_url,
+                 http_session: Optional[requests.Session] = None, timeout: float = 60) -> None:
+        self.year = year
+        self.url = url
+        self.timeout = timeout
+        # ASP.NET keeps state in cookies, so each scraper needs its own session
+        self.http_session = http_session or requests.Session()
+        self.abstract_ids: List[int] = self.get_abstract_id_list()
+
+
+    def post_back(self, page: AbstractPageParser, fields: dict) -> AbstractPageParser:
+        '''Submits the page's form with fields overriding its current values.'''
+        data = dict(page.fields)
+        data.update(fields)
+        response = self.http_session.post(self.url, data=data, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_abstract_page(response.text)
+
+
+    def get_abstract_id_list(self):
+        '''Scrapes list of abstract IDs from webpage.'''
+        response = self.http_session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        page = parse_abstract_page(response.text)
+
+        # Select letting year and submit initial form
+        button_name = page.names_by_id['MainContent_btnByLettingYear']
+        page = self.post_back(page, {
+            page.names_by_id['MainContent_drpLettingYear']: str(self.year),
+            button_name: page.buttons.get(button_name, '')
+        })
+
+        # Set 'Records Per Page' to 'All', which posts back through __EVENTTARGET
+        if 'MainContent_drpPage' in page.names_by_id:
+            page_size_name = page.names_by_id['MainContent_drpPage']
+            page = self.post_back(page, {
+                '__EVENTTARGET': page_size_name,
+                '__EVENTARGUMENT': '',
+                page_size_name: '20000'
+            })
+
+        # Extract contract IDs from the download links
+        contract_ids = list()
+        seen = set()
+        for link in page.links:
+            contract_id = extract_contract_id(urljoin(self.url, link))
+            if contract_id is not None and contract_id not in seen:
+                seen.add(contract_id)
+                contract_ids.append(contract_id)
+
+        return contract_ids
+
+
+def scrape_years(years: List[int], max_workers: int = 4,
+                 url: str = abstract_list_url) -> dict[int, AbstractIDRequestScraper]:
+    '''Scrapes several letting years concurrently with the browserless scraper. A year
+    that fails is printed and left out, keeping the IDs of the other years.'''
+    scrapers = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(AbstractIDRequestScraper, year=year, url=url): year for year in years}
+        for future in as_completed(futures):
+            year = futures[future]
+            try:
+                scrapers[year] = future.result()
+            except Exception as error:
+                print(f'{year}: {error.__class__}: {error}')
+    return {year: scrapers[year] for year in years if year in scrapers}
@@ -1,8 +1,13 @@
 from build.abstract import AbstractData
+import functools
+import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
-from data.model import Bid, Bidder, Contract, Item2018, Item2020
+from data.model import Bid, Bidder, BidPrice, Contract, ContractBidder, Item2018, Item2020
+from sqlalchemy import Float, Integer, Table
 from typing import Union
+from build.metrics import metrics
+from data.storage import ENGINEER_RANK, LONG, WIDE, WIDE_COLUMNS
 from data.unique_items import unique_item_set
 
 
@@ -10,21 +15,76 @@ from data.unique_items import unique_item_set
 # Format helper functions
 ###########################
 
-def get_item_number_as_int(item_number: str):
-    '''Convert ItemNumber string to int'''
-    return int(item_number.replace('/', '').replace('.', ''))
+def get_item_numbers_as_int(item_numbers: pd.Series) -> pd.Series:
+    '''Convert a series of ItemNumber strings to int'''
+    return (
+        item_numbers.str.replace('/', '', regex=False).
+        str.replace('.', '', regex=False).
+        astype('int64')
+    )
 
 
-def price_to_float(price):
-    '''Convert unit price string to float'''
-    return float(price.strip().replace('$', '').replace(',', ''))
+def prices_to_float(prices: pd.Series) -> pd.Series:
+    '''Convert a series of unit price strings to float'''
+    stripped = prices.astype(str).str.strip().str.replace(r'[$,]', '', regex=True)
+    return pd.to_numeric(stripped).astype('float64')
 
 
-def get_unique_bid_id( item_number: str, contract_id: int):
+def prices_to_cents(prices: pd.Series) -> pd.Series:
+    '''Convert a series of price strings to whole cents, kept as float so missing prices stay NaN'''
+    return (prices_to_float(prices) * 100).round()
+
+
+def get_unique_bid_ids(item_numbers: pd.Series, contract_id: int) -> pd.Series:
     '''Generate a unique id for each item bid by concatenating ContractID and ItemNumber, 
     removing the '/' and casting to int'''
-    unique_id = str(contract_id) + item_number.replace('/', '')
-    return int(unique_id)
+    unique_ids = str(contract_id) + item_numbers.str.replace('/', '', regex=False)
+    return unique_ids.astype('int64')
+
+
+def get_spec_years(item_ids: pd.Series) -> pd.Series:
+    '''Returns 2018 for ItemIDs that only exist in the 2018 spec and 2020 otherwise'''
+    return pd.Series(unique_item_set.get_spec_years(item_ids), index=item_ids.index)
+
+
+@functools.lru_cache()
+def table_dtype(table: Table, object_columns: tuple = (), skip_columns: tuple = ()) -> np.dtype:
+    '''Returns the structured dtype of a batch for table: int64 for Integer columns,
+    float64 with NaN for missing values for Float columns, and Python objects with
+    None for missing values for String columns and the Integer object_columns that
+    may be empty. The skip_columns are left out.'''
+    fields = []
+    for column in table.columns:
+        if column.name in skip_columns:
+            continue
+        if isinstance(column.type, Integer) and column.name not in object_columns:
+            fields.append((column.name, '<i8'))
+        elif isinstance(column.type, Float):
+            fields.append((column.name, '<f8'))
+        else:
+            fields.append((column.name, 'O'))
+    return np.dtype(fields)
+
+
+def dataframe_to_batch(df: pd.DataFrame, dtype: np.dtype) -> np.ndarray:
+    '''Converts a dataframe into a batch: a NumPy structured array of dtype holding
+    each column contiguously rather than a Python object per value.'''
+    batch = np.empty(len(df), dtype=dtype)
+    for name in dtype.names:
+        if dtype[name].hasobject:
+            column = df[name].astype(object)
+            batch[name] = column.where(column.notna(), None).to_numpy()
+        else:
+            batch[name] = df[name].to_numpy(dtype=dtype[name])
+    return batch
+
+
+def batch_to_rows(batch: np.ndarray) -> list[dict]:
+    '''Converts a batch into a list of row dictionaries with NaN replaced by None.'''
+    names = batch.dtype.names
+    # NaN is the only value not equal to itself
+    return [{name: None if value != value else value for name, value in zip(names, row)}
+            for row in batch.tolist()]
 
 
 ############################################################################
@@ -33,6 +93,10 @@ def get_unique_bid_id( item_number: str, contract_id: int):
 ############################################################################
 
 class DataTable(ABC):
+    # Integer columns that may be empty, held as Python objects in the batch
+    object_columns: tuple = ()
+    # Columns the destination SQL table does not have, e.g. with long bid storage
+    skip_columns: tuple = ()
 
     @abstractmethod
     def __init__(self, input_data: Union[AbstractData, str]) -> None:
@@ -45,9 +109,19 @@ class DataTable(ABC):
         pass
 
 
-    def create_records(self):
-        '''Creates a list of database model objects (records) from each row of the output_df.'''
-        pass
+    def create_batch(self, output_df: pd.DataFrame) -> np.ndarray:
+        '''Creates a batch, a NumPy structured array with a field per destination SQL
+        table column, from the output_df. Only the batch is kept, so the table holds
+        one compact copy of its rows.'''
+        dtype = table_dtype(self.model.__table__, self.object_columns, self.skip_columns)
+        return dataframe_to_batch(output_df, dtype)
+
+
+    @property
+    def records(self) -> list[dict]:
+        '''Row dictionaries (records) of the batch keyed by the destination SQL table's
+        column names.'''
+        return batch_to_rows(self.batch)
 
 
 class BidderTable(DataTable):
@@ -56,14 +130,15 @@ class BidderTable(DataTable):
 
     def __init__(self, input_data: AbstractData) -> None:
         self.table: str = 'Bidder'
+        self.model = Bidder
         self.input_data = input_data
         self.input_df = self.input_data.bidder_data
-        self.output_df = self.create_output_df()
-        self.records = self.create_records()
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
 
 
     def create_output_df(self):
-        columns = Bidder().__table__.columns.keys()
+        columns = Bidder.__table__.columns.keys()
         output_df = pd.DataFrame(columns=columns)
 
         output_df['BidderID'] = self.input_df['Bidder Number']
@@ -71,41 +146,38 @@ class BidderTable(DataTable):
 
         return output_df
 
-    def create_records(self) -> list[Bidder]:
-        db_records = []
-        for row in self.output_df.itertuples(index=False, name='BidderTable'):
-            record = Bidder(
-                BidderID = row.BidderID,
-                Name = row.Name
-            )
-            db_records.append(record)
-
-        return db_records
-
 
 class ContractTable(DataTable):
     '''Transforms raw contract subtable data into a format that can be inserted 
-    into the Contract SQL table.'''
+    into the Contract SQL table. With long storage the Contract table has no bidder
+    columns and the bidders go to ContractBidderTable instead.'''
+    object_columns = ('BidderID_1', 'BidderID_2')
 
-    def __init__(self, input_data: AbstractData) -> None:
+    def __init__(self, input_data: AbstractData, storage: str = WIDE) -> None:
         self.table: str = 'Contract'
+        self.model = Contract
         self.input_data = input_data
         self.input_df = self.input_data.contract_data
-        self.output_df = self.create_output_df()
-        self.records = self.create_records()
+        self.storage = storage
+        if storage == LONG:
+            self.skip_columns = WIDE_COLUMNS[self.table]
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
 
 
     def create_output_df(self):
-        columns = Contract().__table__.columns.keys()
+        columns = Contract.__table__.columns.keys()
         output_df = pd.DataFrame(columns=columns, dtype='int')
 
         output_df['ContractID'] = self.input_df['Contract Id']
-        output_df['Year'] = self.input_df['Letting Date'].apply(
-            [lambda x: int(x[-4:])])
+        output_df['Year'] = self.input_df['Letting Date'].str[-4:].astype('int64')
         output_df['LetDate'] = self.input_df['Letting Date']
         output_df['SPNumber'] = self.input_df['SP Number']
         output_df['District'] = self.input_df['District']
         output_df['County'] = self.input_df['County']
+        if self.storage == LONG:
+            return output_df
+
         output_df['BidderID_0'] = self.input_data.bidder_id_0
         
         # Check that other bidders exist before adding data
@@ -117,172 +189,137 @@ class ContractTable(DataTable):
         return output_df
 
 
-    def create_records(self) -> list[Contract]:
-        db_records = []
-        for row in self.output_df.itertuples(index=False, name='ContractTable'):
-            record = Contract(
-                ContractID = row.ContractID,
-                Year = row.Year,
-                LetDate = row.LetDate,
-                SPNumber = row.SPNumber,
-                District = row.District,
-                County = row.County,
-                BidderID_0 = row.BidderID_0,
-                BidderID_1 = row.BidderID_1,
-                BidderID_2 = row.BidderID_2
-            )
-            db_records.append(record)
-
-        return db_records
-
-
 class BidTable(DataTable):
     '''Transforms raw contract subtable data into a format that can be inserted 
-    into the Contract SQL table.'''
+    into the Contract SQL table. With long storage the Bid table has no price columns
+    and the prices go to BidPriceTable instead.'''
 
-    def __init__(self, input_data: AbstractData) -> None:
+    def __init__(self, input_data: AbstractData, storage: str = WIDE) -> None:
         self.table: str = 'Bid'
+        self.model = Bid
         self.input_data = input_data
         self.input_df = self.input_data.bid_data
-        self.output_df = self.create_output_df()
-        self.records = self.create_records()
+        self.storage = storage
+        if storage == LONG:
+            self.skip_columns = WIDE_COLUMNS[self.table]
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
 
 
     def create_output_df(self):
-        columns = Bid().__table__.columns.keys()
+        columns = Bid.__table__.columns.keys()
         output_df = pd.DataFrame(columns=columns)
 
-        output_df['BidID'] = self.input_df['ItemNumber'].apply(
-            get_unique_bid_id, args=(self.input_data.contract_id, )
-        )
+        item_numbers = self.input_df['ItemNumber']
+        output_df['BidID'] = get_unique_bid_ids(item_numbers, self.input_data.contract_id)
         output_df['ContractID'] = self.input_data.contract_id
-        output_df['ItemID'] = self.input_df['ItemNumber'].apply(
-            get_item_number_as_int
-        )
-        output_df['SpecYear'] = self.input_df['ItemNumber'].apply(
-            unique_item_set.get_spec_year
-        )
+        output_df['ItemID'] = get_item_numbers_as_int(item_numbers)
+        output_df['SpecYear'] = get_spec_years(output_df['ItemID'])
         output_df['Quantity'] = self.input_df['Quantity']
+        if self.storage == LONG:
+            return output_df
+
         output_df['Engineer_UnitPrice'] = self.input_df['Engineers (Unit Price)']
         output_df['Engineer_TotalPrice'] = self.input_df['Engineers (Extended Amount)']
-        output_df['BidderID_0_UnitPrice'] = self.input_df.iloc[:, 10].apply(
-            price_to_float
-        )
-        output_df['BidderID_0_TotalPrice'] = self.input_df.iloc[:, 11].apply(
-            price_to_float
-        )
-        
-        # Check that other bidders exist before adding data
-        if self.input_data.bidder_id_1:
-            output_df['BidderID_1_UnitPrice'] = self.input_df.iloc[:, 12].apply(
-                price_to_float
-            )
-            output_df['BidderID_1_TotalPrice'] = self.input_df.iloc[:, 13].apply(
-                price_to_float
-            )
 
-        if self.input_data.bidder_id_2:
-            output_df['BidderID_2_UnitPrice'] = self.input_df.iloc[:, 14].apply(
-                price_to_float
-            )
-            output_df['BidderID_2_TotalPrice'] = self.input_df.iloc[:, 15].apply(
-                price_to_float
-            )
+        # The wide columns hold the first three bidders
+        for rank, (unit_price, total_price) in enumerate(self.input_data.bidder_price_columns[:3]):
+            output_df[f'BidderID_{rank}_UnitPrice'] = prices_to_float(self.input_df[unit_price])
+            output_df[f'BidderID_{rank}_TotalPrice'] = prices_to_float(self.input_df[total_price])
 
         return output_df
 
 
-    def create_records(self) -> list[Bid]:
-        db_records = []
-        for row in self.output_df.itertuples(index=False, name='BidTable'):
-            record = Bid(
-                BidID = row.BidID,
-                ContractID = row.ContractID,
-                ItemID = row.ItemID,
-                Quantity = row.Quantity,
-                Engineer_UnitPrice = row.Engineer_UnitPrice,
-                Engineer_TotalPrice = row.Engineer_TotalPrice,
-                BidderID_0_UnitPrice = row.BidderID_0_UnitPrice,
-                BidderID_0_TotalPrice = row.BidderID_0_TotalPrice,
-                BidderID_1_UnitPrice = row.BidderID_1_UnitPrice,
-                BidderID_1_TotalPrice = row.BidderID_1_TotalPrice,
-                BidderID_2_UnitPrice = row.BidderID_2_UnitPrice,
-                BidderID_2_TotalPrice = row.BidderID_2_TotalPrice
-            )
-            db_records.append(record)
-
-        return db_records
+class BidPriceTable(DataTable):
+    '''Transforms raw bid subtable data into a format that can be inserted into the
+    BidPrice SQL table: one row per bid and rank, engineer first, for every bidder on the
+    abstract. Bids without both a unit and a total price from a bidder are left out.'''
+
+    def __init__(self, input_data: AbstractData) -> None:
+        self.table: str = 'BidPrice'
+        self.model = BidPrice
+        self.input_data = input_data
+        self.input_df = self.input_data.bid_data
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
+
+
+    def create_output_df(self):
+        bid_ids = get_unique_bid_ids(self.input_df['ItemNumber'], self.input_data.contract_id)
+
+        price_columns = [(ENGINEER_RANK, ('Engineers (Unit Price)', 'Engineers (Extended Amount)'))]
+        price_columns += enumerate(self.input_data.bidder_price_columns)
+        rank_dfs = []
+        for rank, (unit_price, total_price) in price_columns:
+            rank_dfs.append(pd.DataFrame({
+                'BidID': bid_ids,
+                'Rank': rank,
+                'UnitPriceCents': prices_to_cents(self.input_df[unit_price]),
+                'TotalPriceCents': prices_to_cents(self.input_df[total_price])
+            }))
+
+        output_df = pd.concat(rank_dfs, ignore_index=True)
+        return output_df.dropna(subset=['UnitPriceCents', 'TotalPriceCents'])
+
+
+class ContractBidderTable(DataTable):
+    '''Transforms raw bidder subtable data into a format that can be inserted into the
+    ContractBidder SQL table, ranking the bidders in the order they are listed.'''
+
+    def __init__(self, input_data: AbstractData) -> None:
+        self.table: str = 'ContractBidder'
+        self.model = ContractBidder
+        self.input_data = input_data
+        self.input_df = self.input_data.bidder_data
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
+
+
+    def create_output_df(self):
+        return pd.DataFrame({
+            'ContractID': self.input_data.contract_id,
+            'Rank': np.arange(len(self.input_df)),
+            'BidderID': self.input_df['Bidder Number']
+        })
 
 
 class ItemTable(DataTable):
+    object_columns = ('Item2018_ID',)
+
     def __init__(self, input_data: str, year: int) -> None:
+        if year not in (2018, 2020):
+            raise ValueError
+
         self.table: str = 'Item'
         self.year = year
+        self.model = Item2018 if year == 2018 else Item2020
         self.input_data = input_data
         self.input_df = pd.read_csv(self.input_data)
-        self.output_df = self.create_output_df()
-        self.records = self.create_records()
+        with metrics.timer('transform_seconds', table=self.table):
+            self.batch = self.create_batch(self.create_output_df())
 
 
     def create_output_df(self) -> pd.DataFrame:
-        columns = Item2018().__table__.columns.keys()
+        columns = ['ItemID', 'SpecCode', 'UnitCode', 'ItemCode', 'Description', 'Unit']
         output_df = pd.DataFrame(columns=columns)
 
-        output_df['ItemID'] = self.input_df['Item Number'].apply(
-            get_item_number_as_int
-        )
-        output_df['SpecCode'] = self.input_df['Item Number'].apply(
-            lambda x: x[:4]
-        )
-        output_df['UnitCode'] = self.input_df['Item Number'].apply(
-            lambda x: x[5:8]
-        )
-        output_df['ItemCode'] = self.input_df['Item Number'].apply(
-            lambda x: x[9:]
-        )
+        item_numbers = self.input_df['Item Number']
+        output_df['ItemID'] = get_item_numbers_as_int(item_numbers)
+        output_df['SpecCode'] = item_numbers.str[:4]
+        output_df['UnitCode'] = item_numbers.str[5:8]
+        output_df['ItemCode'] = item_numbers.str[9:]
         output_df['Description'] = self.input_df['Long Description']
         output_df['Unit'] = self.input_df['Unit Name']
 
         return output_df
 
 
-    def create_records_2018(self) -> list[Item2018]:
-        db_records = []
-        for row in self.output_df.itertuples(index=False, name='ItemTable'):
-            record = Item2018(
-                ItemID_2018 = row.ItemID,
-                SpecCode_2018 = row.SpecCode,
-                UnitCode_2018 = row.UnitCode,
-                ItemCode_2018 = row.ItemCode,
-                Description_2018 = row.Description,
-                Unit_2018 = row.Unit
-            )
-            db_records.append(record)
-
-        return db_records
-
-
-    def create_records_2020(self) -> list[Item2020]:
-        db_records = []
-        for row in self.output_df.itertuples(index=False, name='ItemTable'):
-            record = Item2020(
-                ItemID_2020 = row.ItemID,
-                SpecCode_2020 = row.SpecCode,
-                UnitCode_2020 = row.UnitCode,
-                ItemCode_2020 = row.ItemCode,
-                Description_2020 = row.Description,
-                Unit_2020 = row.Unit,
-                Item2018_ID = None
-            )
-            db_records.append(record)
-
-        return db_records
-
-
-    def create_records(self):
+    def create_batch(self, output_df: pd.DataFrame) -> np.ndarray:
+        '''Creates a batch with the Item2018 or Item2020 column names.'''
+        # Item tables suffix each column with their spec year, e.g. ItemID_2018
+        suffix = f'_{self.year}'
+        output_df = output_df.add_suffix(suffix)
         if self.year == 2020:
-            return self.create_records_2020()
-        elif self.year == 2018:
-            return self.create_records_2018()
-        else:
-            raise ValueError
\ No newline at end of file
+            output_df['Item2018_ID'] = None
+
+        return super().create_batch(output_df)
@@ -0,0 +1,134 @@
+import gzip
+import os
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from data.binary_index import write_binary_index
+
+
+class ChunkWriter(ABC):
+    '''Context manager that appends dataframe chunks to a single output file.'''
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.row_count = 0
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    @abstractmethod
+    def write(self, df: pd.DataFrame):
+        '''Appends a chunk to the output file.'''
+        pass
+
+
+    @abstractmethod
+    def close(self):
+        '''Finishes and closes the output file.'''
+        pass
+
+
+class CsvChunkWriter(ChunkWriter):
+    '''Writes chunks to a csv file, gzip compressed if the filename ends in .gz.
+    The header is written with the first chunk.'''
+
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename)
+        if filename.endswith('.gz'):
+            self.file = gzip.open(filename, 'wt', newline='')
+        else:
+            self.file = open(filename, 'w', newline='')
+        self.header = True
+
+
+    def write(self, df: pd.DataFrame):
+        df.to_csv(self.file, header=self.header)
+        self.header = False
+        self.row_count += len(df)
+
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetChunkWriter(ChunkWriter):
+    '''Writes each chunk as a row group of a parquet file. Requires pyarrow.'''
+
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError('pyarrow is required to export parquet files') from e
+
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.writer = None
+
+
+    def write(self, df: pd.DataFrame):
+        if self.writer is None:
+            table = self.pyarrow.Table.from_pandas(df)
+            self.writer = self.parquet.ParquetWriter(self.filename, table.schema)
+        else:
+            table = self.pyarrow.Table.from_pandas(df, schema=self.writer.schema)
+        self.writer.write_table(table)
+        self.row_count += len(df)
+
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class BinaryIndexChunkWriter(ChunkWriter):
+    '''Collects the numeric columns of each chunk, indexed by ItemID, and writes them as a
+    memory-mappable binary price index on close. Text columns such as Description are
+    left out and the columns are fixed by the first chunk.'''
+
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename)
+        self.columns = None
+        self.item_ids = []
+        self.chunks = []
+
+
+    def write(self, df: pd.DataFrame):
+        if self.columns is None:
+            self.columns = list(df.select_dtypes('number').columns)
+        self.item_ids.append(df.index.to_numpy(dtype='int64'))
+        self.chunks.append(df.reindex(columns=self.columns).to_numpy(dtype='float64'))
+        self.row_count += len(df)
+
+
+    def __exit__(self, type, value, traceback):
+        # An interrupted export leaves any previous index in place rather than a partial one
+        if type is None:
+            self.close()
+
+
+    def close(self):
+        columns = self.columns or []
+        values = np.concatenate(self.chunks) if self.chunks else np.empty((0, len(columns)))
+        item_ids = np.concatenate(self.item_ids) if self.item_ids else np.empty(0, dtype='int64')
+        write_binary_index(self.filename, item_ids, {name: values[:, i] for i, name in enumerate(columns)})
+
+
+def open_chunk_writer(filename: str) -> ChunkWriter:
+    '''Returns a parquet writer for .parquet files, a binary price index writer for .idx
+    files and a csv writer otherwise.'''
+    if filename.endswith('.parquet'):
+        return ParquetChunkWriter(filename)
+    if filename.endswith('.idx'):
+        return BinaryIndexChunkWriter(filename)
+    return CsvChunkWriter(filename)
@@ -0,0 +1,326 @@
+'''Command line interface for building and exporting the bid abstract database.
+
+    python cli.py scrape 2022            add newly posted abstract IDs
+    python cli.py process                fetch and load unprocessed abstracts
+    python cli.py export                 export weighted average unit prices
+    python cli.py rebuild                reload the bid tables from the abstract cache
+    python cli.py stats                  export unit price statistics
+    python cli.py migrate                switch to long bid storage
+
+Only argparse is imported up front. Each subcommand imports the modules it needs
+when it runs, so --help and runs with nothing to do start quickly.'''
+
+import argparse
+import sys
+from datetime import datetime
+from typing import Optional
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--metrics-file', default=None,
+                        help='write Prometheus text format metrics to this file')
+    parser.add_argument('--log-json', default=None,
+                        help='append structured JSON log lines to this file (- for stdout)')
+
+
+def enable_metrics(args: argparse.Namespace):
+    # Metrics cost nothing unless one of their outputs is requested
+    if args.metrics_file or args.log_json:
+        from build.metrics import metrics
+        metrics.enable(log_file=args.log_json, prometheus_file=args.metrics_file)
+
+
+def add_location_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--district', default=None)
+    parser.add_argument('--county', default=None)
+
+
+def add_statistics_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--percentiles', type=float, nargs='*', default=None,
+                        help='unit price percentiles to export (default: 10 25 75 90)')
+    parser.add_argument('--trim', type=float, default=None,
+                        help='fraction of bids trimmed from each end for the trimmed mean (default: 0.1)')
+
+
+def statistics_options(args: argparse.Namespace) -> dict:
+    '''Returns the statistics arguments that were given, leaving the rest to their defaults.'''
+    options = {'percentiles': args.percentiles, 'trim': args.trim}
+    return {name: value for name, value in options.items() if value is not None}
+
+
+############
+# scrape
+############
+
+def add_scrape_parser(subparsers):
+    parser = subparsers.add_parser('scrape', help='scrape abstract IDs into the database',
+                                   description='Scrape abstract IDs into the database.')
+    parser.add_argument('years', nargs='*', type=int, default=[datetime.now().year],
+                        help='letting years to scrape (default: current year)')
+    parser.add_argument('--browser', action='store_true',
+                        help='scrape with selenium and firefox instead of plain http requests')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of years scraped concurrently')
+    parser.add_argument('--url', default=None,
+                        help='abstract list page, e.g. a local stub server')
+    parser.set_defaults(run=scrape, parser=parser)
+
+
+def scrape(args: argparse.Namespace):
+    from scrape_abstract_ids import scrape_abstract_ids, scrape_abstract_ids_for_years
+
+    if args.browser:
+        for year in args.years:
+            scrape_abstract_ids(year, browser=True)
+    elif args.url:
+        scrape_abstract_ids_for_years(args.years, max_workers=args.workers, url=args.url)
+    else:
+        scrape_abstract_ids_for_years(args.years, max_workers=args.workers)
+
+
+############
+# process
+############
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the raw abstract cache (default: data/cache)')
+
+
+def open_cache(args: argparse.Namespace):
+    from build.cache import AbstractCache
+    return AbstractCache(args.cache_dir) if args.cache_dir else AbstractCache()
+
+
+def add_process_parser(subparsers):
+    parser = subparsers.add_parser('process', help='fetch and load unprocessed abstracts',
+                                   description='Fetch and load unprocessed abstracts.')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='maximum number of abstracts to process')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent abstract downloads')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='number of parse processes (default: cpu count, 0 parses in-process)')
+    parser.add_argument('--queue-size', type=int, default=32,
+                        help='maximum abstracts waiting between pipeline stages')
+    parser.add_argument('--rate', type=float, default=4.0,
+                        help='maximum requests per second to MnDOT (0 disables the limit)')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='number of abstracts loaded per database commit')
+    add_cache_arguments(parser)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not read or write the raw abstract cache')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--offline', action='store_true',
+                      help='only use cached abstracts, never the network')
+    mode.add_argument('--refresh', action='store_true',
+                      help='re-download processed abstracts and reload those that changed')
+    mode.add_argument('--rebuild', action='store_true',
+                      help='same as the rebuild subcommand')
+    parser.add_argument('--queue', action='store_true',
+                        help='claim abstracts from the shared work queue, for running several workers')
+    parser.add_argument('--worker-id', default=None,
+                        help='name of this queue worker (default: hostname:pid)')
+    parser.add_argument('--lease', type=float, default=None,
+                        help='seconds a claimed batch is held before other workers may reclaim it '
+                             '(default: 600)')
+    parser.add_argument('--max-attempts', type=int, default=None,
+                        help='attempts before a failing abstract is no longer retried by the queue '
+                             '(default: 5)')
+    add_metrics_arguments(parser)
+    parser.set_defaults(run=process, parser=parser)
+
+
+def process(args: argparse.Namespace):
+    if args.queue and (args.refresh or args.rebuild or args.limit is not None):
+        args.parser.error('--queue cannot be combined with --refresh, --rebuild or --limit')
+    if args.rebuild:
+        if args.no_cache:
+            args.parser.error('--rebuild requires the cache')
+        rebuild(args)
+        return
+
+    enable_metrics(args)
+    from process_abstracts import get_processed_abstract_ids, process_abstracts
+    from data.model import Session
+
+    cache = None if args.no_cache else open_cache(args)
+
+    work_queue = None
+    if args.queue:
+        from build.claims import WorkQueue
+        from data.model import engine, use_immediate_transactions
+
+        # Workers take the write lock up front so they queue on it instead of failing
+        use_immediate_transactions(engine)
+        options = {'lease_seconds': args.lease, 'max_attempts': args.max_attempts}
+        work_queue = WorkQueue(args.worker_id,
+                               **{name: value for name, value in options.items() if value is not None})
+
+    abstract_ids = None
+    if args.refresh:
+        with Session() as session:
+            abstract_ids = get_processed_abstract_ids(session)
+
+    process_abstracts(abstract_ids, limit=args.limit, max_workers=args.workers, rate=args.rate,
+                      cache=cache, offline=args.offline, refresh=args.refresh,
+                      batch_size=args.batch_size, parse_workers=args.parse_workers,
+                      queue_size=args.queue_size, work_queue=work_queue)
+
+
+############
+# rebuild
+############
+
+def add_rebuild_parser(subparsers):
+    parser = subparsers.add_parser('rebuild', help='rebuild the bid tables from the abstract cache',
+                                   description='Rebuild the Contract, Bid, Bidder and BidAggregate '
+                                               'tables from the raw abstract cache, without network requests.')
+    add_cache_arguments(parser)
+    parser.add_argument('--aggregates', action='store_true',
+                        help='only recompute the BidAggregate table from the Bid table')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='number of concurrent cache reads')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='number of parse processes (default: cpu count, 0 parses in-process)')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='number of abstracts loaded per database commit')
+    add_metrics_arguments(parser)
+    parser.set_defaults(run=rebuild, parser=parser)
+
+
+def rebuild(args: argparse.Namespace):
+    enable_metrics(args)
+    if getattr(args, 'aggregates', False):
+        from build.aggregate import main as rebuild_aggregates
+        rebuild_aggregates()
+        return
+
+    from process_abstracts import rebuild_from_cache
+    rebuild_from_cache(open_cache(args), max_workers=args.workers, batch_size=args.batch_size,
+                       parse_workers=args.parse_workers)
+
+
+############
+# export
+############
+
+def add_export_parser(subparsers):
+    parser = subparsers.add_parser('export', help='export weighted average unit prices',
+                                   description='Export weighted average unit prices.')
+    parser.add_argument('filename', nargs='?', default='exports/Spec2018_weighted_average_all.csv',
+                        help='output file (.csv, .csv.gz, .parquet or .idx)')
+    parser.add_argument('--source', choices=['aggregates', 'bids'], default='aggregates',
+                        help='compute from the BidAggregate table or directly from the Bid table')
+    parser.add_argument('--chunksize', type=int, default=10000,
+                        help='number of total rows read from the database at a time')
+    parser.add_argument('--backend', choices=['sqlite', 'duckdb'], default='sqlite',
+                        help='database engine for the grouping query (duckdb is optional)')
+    add_location_arguments(parser)
+    parser.add_argument('--index', default=None,
+                        help='also write a memory-mappable binary price index to this file')
+    parser.add_argument('--statistics', action='store_true',
+                        help='also export median, percentile and trimmed mean unit prices (reads every bid)')
+    add_statistics_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.set_defaults(run=export, parser=parser)
+
+
+def export(args: argparse.Namespace):
+    if args.statistics:
+        stats(args)
+        return
+
+    enable_metrics(args)
+    from build.metrics import metrics
+    from export_weighted_avg_csv import export_weighted_avg
+
+    row_count = export_weighted_avg(args.filename, source=args.source, chunksize=args.chunksize,
+                                    district=args.district, county=args.county,
+                                    backend=args.backend, index_filename=args.index)
+    print(f'Exported {row_count} items to {args.filename}')
+    metrics.write()
+
+
+############
+# stats
+############
+
+def add_stats_parser(subparsers):
+    parser = subparsers.add_parser('stats', help='export unit price statistics',
+                                   description='Export the contract occurrences, weighted average, '
+                                               'median, percentile and trimmed mean unit prices of '
+                                               'every item per year and bidder category.')
+    parser.add_argument('filename', nargs='?', default='exports/Spec2018_bid_statistics.csv',
+                        help='output file (.csv, .csv.gz or .parquet)')
+    add_location_arguments(parser)
+    add_statistics_arguments(parser)
+    add_metrics_arguments(parser)
+    parser.set_defaults(run=stats, parser=parser)
+
+
+def stats(args: argparse.Namespace):
+    enable_metrics(args)
+    from build.metrics import metrics
+    from export_weighted_avg_csv import export_bid_statistics
+
+    row_count = export_bid_statistics(args.filename, district=args.district, county=args.county,
+                                      **statistics_options(args))
+    print(f'Exported {row_count} items to {args.filename}')
+    metrics.write()
+
+
+############
+# migrate
+############
+
+def add_migrate_parser(subparsers):
+    parser = subparsers.add_parser('migrate', help='switch the database to long bid storage',
+                                   description='Move the bid prices from the wide Bid columns into the '
+                                               'BidPrice table, one row per bid and bidder rank in '
+                                               'integer cents, drop the wide Bid and Contract columns '
+                                               'and vacuum the database. Every bidder of new abstracts '
+                                               'is loaded.')
+    parser.set_defaults(run=migrate, parser=parser)
+
+
+def migrate(args: argparse.Namespace):
+    import os
+    from build.aggregate import main as rebuild_aggregates
+    from data.model import engine, vacuum
+    from data.storage import migrate_to_long_storage
+
+    database = engine.url.database if engine.dialect.name == 'sqlite' else None
+    size = os.path.getsize(database) if database and os.path.exists(database) else None
+    if not migrate_to_long_storage(engine):
+        print('The database already has long bid storage.')
+        return
+
+    # Bids without both prices were not copied, so the totals are recomputed from BidPrice
+    rebuild_aggregates()
+    # The dropped columns and rebuilt aggregates leave free pages until the file is rewritten
+    vacuum(engine)
+    print('Migrated to long bid storage.')
+    if size is not None:
+        print(f'Database size {size / 2**20:.1f} MiB -> {os.path.getsize(database) / 2**20:.1f} MiB')
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Build and export the MnDOT bid abstract database.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+    add_scrape_parser(subparsers)
+    add_process_parser(subparsers)
+    add_export_parser(subparsers)
+    add_rebuild_parser(subparsers)
+    add_stats_parser(subparsers)
+    add_migrate_parser(subparsers)
+    return parser
+
+
+def main(argv: Optional[list[str]] = None):
+    args = create_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,28 +1,35 @@
+from build.loader import insert_batch_or_ignore
 from build.table import ItemTable
-from data.model import Base, Item2020, Session, engine, Item2018
+from data.model import Base, Item2020, Session, add_missing_columns, create_indexes, engine, Item2018
 
 
-# create all tables
-Base.metadata.create_all(engine)
+def create_database_tables():
+    '''Creates all tables and indexes and populates the item tables from csv.'''
+    # create all tables and any columns or indexes missing from existing tables
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    create_indexes(engine)
 
-# populate Item2018 table from csv
-item2018_csv = 'data/2018_TrnsportItemList.csv'
-item2018_table = ItemTable(item2018_csv, year=2018)
+    # populate Item2018 table from csv
+    item2018_csv = 'data/2018_TrnsportItemList.csv'
+    item2018_table = ItemTable(item2018_csv, year=2018)
 
-with Session() as session:
-    for record in item2018_table.records:
-        if session.get(Item2018, ident=record.ItemID_2018) is None:
-            session.add(record)
+    with Session() as session:
+        insert_batch_or_ignore(session, Item2018, item2018_table.batch)
+        session.commit()
 
-    session.commit()
+    # populate Item2020 table from csv
+    item2020_csv = 'data/2020_TrnsportItemList.csv'
+    item2020_table = ItemTable(item2020_csv, year=2020)
 
-# populate Item2018 table from csv
-item2020_csv = 'data/2020_TrnsportItemList.csv'
-item2020_table = ItemTable(item2020_csv, year=2020)
+    with Session() as session:
+        insert_batch_or_ignore(session, Item2020, item2020_table.batch)
+        session.commit()
 
-with Session() as session:
-    for record in item2020_table.records:
-        if session.get(Item2020, ident=record.ItemID_2020) is None:
-            session.add(record)
 
-    session.commit()
+def main():
+    create_database_tables()
+
+
+if __name__ == '__main__':
+    main()
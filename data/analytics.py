@@ -0,0 +1,52 @@
+from typing import Iterator
+import pandas as pd
+from sqlalchemy.dialects import sqlite
+from data.model import engine
+
+
+def duckdb_available() -> bool:
+    try:
+        import duckdb
+    except ImportError:
+        return False
+    return True
+
+
+def connect_duckdb(sqlite_path: str = None):
+    '''Returns an in-memory DuckDB connection with the SQLite database attached
+    read-only as the default catalog. DuckDB is optional and only used to run the
+    analytical export queries on its columnar engine.'''
+    import duckdb
+
+    if sqlite_path is None:
+        if engine.dialect.name != 'sqlite':
+            raise ValueError('The DuckDB backend requires a SQLite database')
+        sqlite_path = engine.url.database
+
+    conn = duckdb.connect()
+    conn.execute('INSTALL sqlite')
+    conn.execute('LOAD sqlite')
+    conn.execute(f"ATTACH '{sqlite_path}' AS bids (TYPE sqlite, READ_ONLY)")
+    conn.execute('USE bids')
+    return conn
+
+
+def compile_statement(statement) -> str:
+    '''Renders a SQLAlchemy select as a SQL string with its parameters inlined.'''
+    compiled = statement.compile(dialect=sqlite.dialect(), compile_kwargs={'literal_binds': True})
+    return str(compiled)
+
+
+def read_sql_chunks_duckdb(statement, chunksize: int, sqlite_path: str = None) -> Iterator[pd.DataFrame]:
+    '''Runs a select on DuckDB and yields the result as dataframes of up to chunksize rows.'''
+    conn = connect_duckdb(sqlite_path)
+    try:
+        result = conn.execute(compile_statement(statement))
+        columns = [column[0] for column in result.description]
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+    finally:
+        conn.close()
@@ -0,0 +1,151 @@
+'''Compact binary price index: the numeric columns of a weighted average export
+keyed by sorted ItemID, laid out so readers can memory-map it and use each
+column as a NumPy view without parsing or copying.
+
+Layout (little-endian):
+    8 bytes   MAGIC
+    uint32    FORMAT_VERSION
+    uint32    length of the JSON header
+    JSON      {"rows": n, "key": "ItemID", "columns": [{"name", "dtype", "offset"}, ...]}
+    columns   each n values of its dtype, starting at its offset, 64-byte aligned
+
+The ItemID key column is int64 and sorted, so lookups are a binary search.'''
+
+import json
+import mmap
+import os
+import struct
+from typing import Optional
+import numpy as np
+
+
+MAGIC = b'MNDOTIDX'
+FORMAT_VERSION = 1
+PREFIX = struct.Struct('<8sII')
+ALIGNMENT = 64
+KEY = 'ItemID'
+KEY_DTYPE = '<i8'
+
+
+def column_dtype(name: str) -> str:
+    '''Occurrence counts are stored as int32 and prices as float64, which keeps cents exact.'''
+    return '<i4' if name.endswith('ContractOccurrence') else '<f8'
+
+
+def align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_binary_index(filename: str, item_ids: np.ndarray, columns: dict[str, np.ndarray]):
+    '''Writes item_ids and the equal-length arrays of columns as a binary price index,
+    sorted by ItemID. Missing occurrence counts are written as 0 and missing prices as NaN.
+    The file is written beside filename and moved into place, so readers never see a
+    partial index.'''
+    order = np.argsort(item_ids, kind='stable')
+    arrays = {KEY: np.asarray(item_ids, dtype=KEY_DTYPE)[order]}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype='float64')[order]
+        dtype = column_dtype(name)
+        if dtype == '<i4':
+            values = np.nan_to_num(values, nan=0)
+        arrays[name] = values.astype(dtype)
+
+    # Column offsets depend on the header length, so lay out until it is stable
+    header_length = 0
+    while True:
+        offset = align(PREFIX.size + header_length)
+        layout = []
+        for name, values in arrays.items():
+            layout.append({'name': name, 'dtype': values.dtype.str, 'offset': offset})
+            offset = align(offset + values.nbytes)
+        header = json.dumps({'rows': len(arrays[KEY]), 'key': KEY, 'columns': layout}).encode()
+        if len(header) == header_length:
+            break
+        header_length = len(header)
+
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for column, values in zip(layout, arrays.values()):
+            f.write(b'\0' * (column['offset'] - f.tell()))
+            f.write(values.tobytes())
+        # Pad to the end of the layout so empty columns still map
+        f.write(b'\0' * (offset - f.tell()))
+    os.replace(temp_filename, filename)
+
+
+class BinaryPriceIndex():
+    '''Read-only view of a binary price index file. The file is memory-mapped, so
+    opening it reads only the header and every process reading the same file shares
+    its pages. column() returns zero-copy NumPy views and lookup() binary searches
+    the sorted ItemIDs.'''
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_length = PREFIX.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not a binary price index')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'{filename} has format version {version}, expected {FORMAT_VERSION}')
+        header = json.loads(self.mmap[PREFIX.size:PREFIX.size + header_length])
+
+        self.row_count = header['rows']
+        self._views = {
+            column['name']: np.frombuffer(self.mmap, dtype=column['dtype'], count=self.row_count,
+                                          offset=column['offset'])
+            for column in header['columns']
+        }
+        self.item_ids = self._views[header['key']]
+        self.columns = [name for name in self._views if name != header['key']]
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+    def __len__(self) -> int:
+        return self.row_count
+
+
+    def __contains__(self, item_id: int) -> bool:
+        return self.position(item_id) is not None
+
+
+    def column(self, name: str) -> np.ndarray:
+        '''Returns a read-only view of a column, in ItemID order.'''
+        return self._views[name]
+
+
+    def position(self, item_id: int) -> Optional[int]:
+        '''Returns the row of item_id, or None if it is not in the index.'''
+        position = int(np.searchsorted(self.item_ids, item_id))
+        if position < self.row_count and self.item_ids[position] == item_id:
+            return position
+        return None
+
+
+    def lookup(self, item_id: int) -> Optional[dict]:
+        '''Returns every column of item_id as a dict, or None if it is not in the index.'''
+        position = self.position(item_id)
+        if position is None:
+            return None
+        return {name: self._views[name][position].item() for name in self.columns}
+
+
+    def close(self):
+        '''Unmaps the file. Views returned by column() that are still referenced keep
+        the map open until they are released.'''
+        self._views = {}
+        self.item_ids = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
@@ -1,13 +1,63 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+import os
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index, event, inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.engine.create import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import deferred, sessionmaker
 
 
-CONNECTION_STRING = "sqlite+pysqlite:///data/db.sqlite"
+# Override with the MNDOT_DB_URL environment variable, e.g. sqlite+pysqlite:////abs/path.sqlite
+CONNECTION_STRING = os.environ.get('MNDOT_DB_URL', "sqlite+pysqlite:///data/db.sqlite")
 
 
-engine = create_engine(CONNECTION_STRING)
+# WAL lets readers (exports) run while the loader writes, NORMAL sync is safe in WAL
+# mode, and a larger page cache and mmap speed up the export joins
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -65536,  # KiB, i.e. 64 MiB
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,
+    'busy_timeout': 60000  # ms to wait for another process's write lock
+}
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''Applies SQLITE_PRAGMAS to each new SQLite connection.'''
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma}={value}')
+    cursor.close()
+
+
+def create_db_engine(connection_string: str = CONNECTION_STRING, tuned: bool = True) -> Engine:
+    '''Creates an engine for connection_string, applying the tuned pragmas to SQLite databases.'''
+    engine = create_engine(connection_string)
+    if tuned and engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+    return engine
+
+
+def use_immediate_transactions(engine: Engine):
+    '''Makes SQLite transactions take the write lock when they begin. With several
+    processes writing to one database, a deferred transaction that reads before
+    writing fails with "database is locked" instead of waiting for the lock.'''
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def begin_immediate(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    # Connections opened before the listeners were added are replaced
+    engine.dispose()
+
+
+engine = create_db_engine()
 
 Session = sessionmaker(engine)
 
@@ -71,7 +121,14 @@ class Abstract(Base):
 
     AbstractID = Column(Integer, primary_key=True, unique=True)
     Year = Column(Integer)
-    Processed = Column(String)
+    # NO, CLAIMED (leased by a queue worker), YES or ERROR
+    Processed = Column(String, index=True)
+    # Work queue lease, as epoch seconds, and error retry state
+    ClaimedBy = Column(String)
+    ClaimedAt = Column(Float)
+    LeaseExpires = Column(Float)
+    Attempts = Column(Integer, default=0)
+    RetryAfter = Column(Float)
 
 
     def __str__(self) -> str:
@@ -79,21 +136,27 @@ class Abstract(Base):
 
 
     def __repr__(self) -> str:
-        return f'AbstractID = {self.AbstractID}, Year = {self.Year}, Processed = {self.Processed}'
+        return (f'AbstractID = {self.AbstractID}, Year = {self.Year}, Processed = {self.Processed}, '
+                f'ClaimedBy = {self.ClaimedBy}, Attempts = {self.Attempts}')
 
 
 class Contract(Base):
+    '''The BidderID columns are dropped with long bid storage, see data.storage, so
+    they are deferred: loading a Contract only reads them when they are accessed.'''
     __tablename__ = "Contract"
+    __table_args__ = (
+        Index('ix_Contract_District_County', 'District', 'County'),
+    )
 
     ContractID = Column(Integer, primary_key=True, unique=True)
-    Year = Column(Integer)
+    Year = Column(Integer, index=True)
     LetDate = Column(String)
     SPNumber = Column(String)
     District = Column(String)
     County = Column(String)
-    BidderID_0 = Column(Integer, ForeignKey("Bidder.BidderID"))
-    BidderID_1 = Column(Integer, ForeignKey("Bidder.BidderID"))
-    BidderID_2 = Column(Integer, ForeignKey("Bidder.BidderID"))
+    BidderID_0 = deferred(Column(Integer, ForeignKey("Bidder.BidderID")), group='wide')
+    BidderID_1 = deferred(Column(Integer, ForeignKey("Bidder.BidderID")), group='wide')
+    BidderID_2 = deferred(Column(Integer, ForeignKey("Bidder.BidderID")), group='wide')
 
 
     def __str__(self) -> str:
@@ -115,21 +178,23 @@ class Contract(Base):
 
 
 class Bid(Base):
+    '''The price columns are dropped with long bid storage, see data.storage, so
+    they are deferred: loading a Bid only reads them when they are accessed.'''
     __tablename__ = "Bid"
 
     BidID = Column(Integer, primary_key=True, unique=True)
-    ContractID = Column(Integer, ForeignKey("Contract.ContractID"))
-    ItemID = Column(Integer)
+    ContractID = Column(Integer, ForeignKey("Contract.ContractID"), index=True)
+    ItemID = Column(Integer, index=True)
     SpecYear = Column(Integer)
     Quantity = Column(Float)
-    Engineer_UnitPrice = Column(Float)
-    Engineer_TotalPrice = Column(Float)
-    BidderID_0_UnitPrice = Column(Float)
-    BidderID_0_TotalPrice = Column(Float)
-    BidderID_1_UnitPrice = Column(Float)
-    BidderID_1_TotalPrice = Column(Float)
-    BidderID_2_UnitPrice = Column(Float)
-    BidderID_2_TotalPrice = Column(Float)
+    Engineer_UnitPrice = deferred(Column(Float), group='wide')
+    Engineer_TotalPrice = deferred(Column(Float), group='wide')
+    BidderID_0_UnitPrice = deferred(Column(Float), group='wide')
+    BidderID_0_TotalPrice = deferred(Column(Float), group='wide')
+    BidderID_1_UnitPrice = deferred(Column(Float), group='wide')
+    BidderID_1_TotalPrice = deferred(Column(Float), group='wide')
+    BidderID_2_UnitPrice = deferred(Column(Float), group='wide')
+    BidderID_2_TotalPrice = deferred(Column(Float), group='wide')
 
 
     def __str__(self) -> str:
@@ -153,6 +218,86 @@ class Bid(Base):
         return ', '.join( [a, b, c, d, e, f, g, h, i, j, k, l] )
 
 
+class BidPrice(Base):
+    '''Bid prices in long form, one row per bid and bidder rank with prices in integer
+    cents, used instead of the Bid price columns when the database has long bid storage.
+    Rank -1 is the engineer's estimate and 0, 1, 2, ... are the bidders in the order
+    they are listed on the abstract, so any number of bidders fits. The rows are
+    clustered on (BidID, Rank), so the prices of a contract's bids are found through
+    the Bid ContractID index without an index of their own.'''
+    __tablename__ = "BidPrice"
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    BidID = Column(Integer, ForeignKey("Bid.BidID"), primary_key=True)
+    Rank = Column(Integer, primary_key=True, autoincrement=False)
+    UnitPriceCents = Column(Integer, nullable=False)
+    TotalPriceCents = Column(Integer, nullable=False)
+
+
+    def __str__(self) -> str:
+        return f'BidPrice(BidID={self.BidID}, Rank={self.Rank})'
+
+
+    def __repr__(self) -> str:
+        a = f'BidID = {self.BidID}'
+        b = f'Rank = {self.Rank}'
+        c = f'UnitPriceCents = {self.UnitPriceCents}'
+        d = f'TotalPriceCents = {self.TotalPriceCents}'
+
+        return ', '.join( [a, b, c, d] )
+
+
+class ContractBidder(Base):
+    '''The bidders of each contract by rank, the long storage counterpart of the
+    Contract BidderID columns.'''
+    __tablename__ = "ContractBidder"
+
+    ContractID = Column(Integer, ForeignKey("Contract.ContractID"), primary_key=True)
+    Rank = Column(Integer, primary_key=True, autoincrement=False)
+    BidderID = Column(Integer, ForeignKey("Bidder.BidderID"), index=True)
+
+
+    def __str__(self) -> str:
+        return f'ContractBidder(ContractID={self.ContractID}, Rank={self.Rank})'
+
+
+    def __repr__(self) -> str:
+        return f'ContractID = {self.ContractID}, Rank = {self.Rank}, BidderID = {self.BidderID}'
+
+
+class BidAggregate(Base):
+    '''Running totals of bid prices per item, year, bidder category and location.
+    Kept up to date as abstracts are loaded so weighted averages can be computed
+    without reading the Bid table.'''
+    __tablename__ = "BidAggregate"
+
+    ItemID = Column(Integer, primary_key=True)
+    Year = Column(Integer, primary_key=True)
+    BidderCategory = Column(String, primary_key=True)
+    District = Column(String, primary_key=True)
+    County = Column(String, primary_key=True)
+    TotalPriceSum = Column(Float)
+    QuantitySum = Column(Float)
+    Occurrences = Column(Integer)
+
+
+    def __str__(self) -> str:
+        return f'BidAggregate(ItemID={self.ItemID}, Year={self.Year}, BidderCategory={self.BidderCategory})'
+
+
+    def __repr__(self) -> str:
+        a = f'ItemID = {self.ItemID}'
+        b = f'Year = {self.Year}'
+        c = f'BidderCategory = {self.BidderCategory}'
+        d = f'District = {self.District}'
+        e = f'County = {self.County}'
+        f = f'TotalPriceSum = {self.TotalPriceSum}'
+        g = f'QuantitySum = {self.QuantitySum}'
+        h = f'Occurrences = {self.Occurrences}'
+
+        return ', '.join( [a, b, c, d, e, f, g, h] )
+
+
 class Bidder(Base):
     __tablename__ = "Bidder"
 
@@ -168,9 +313,66 @@ class Bidder(Base):
         return f'BidderID = {self.BidderID}, Name = {self.Name}'
 
 
+class Setting(Base):
+    '''Database wide options by name, e.g. BidStorage.'''
+    __tablename__ = "Setting"
+
+    Name = Column(String, primary_key=True)
+    Value = Column(String)
+
+
+    def __repr__(self) -> str:
+        return f'Name = {self.Name}, Value = {self.Value}'
+
+
+def create_indexes(bind: Engine = engine):
+    '''Creates any indexes missing from existing tables. create_all() only creates
+    indexes along with new tables, so this migrates databases built before the
+    indexes were declared.'''
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
+def add_missing_columns(bind: Engine = engine):
+    '''Adds columns declared on the models but missing from existing tables, which
+    create_all() does not do, e.g. the Abstract work queue columns. The wide storage
+    columns dropped by long bid storage are not added back.'''
+    # data.storage imports this module
+    from data.storage import LONG, WIDE_COLUMNS, get_bid_storage
+
+    inspector = inspect(bind)
+    table_names = inspector.get_table_names()
+    with bind.begin() as conn:
+        dropped = WIDE_COLUMNS if get_bid_storage(conn) == LONG else {}
+        for table in Base.metadata.sorted_tables:
+            if table.name not in table_names:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            existing.update(dropped.get(table.name, ()))
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+
+
+def vacuum(bind: Engine = engine):
+    '''Rewrites a SQLite database file without its free pages, e.g. after a migration
+    cleared or deleted many rows, and truncates the write-ahead log.'''
+    if bind.dialect.name != 'sqlite':
+        return
+    # VACUUM cannot run inside a transaction
+    with bind.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        conn.exec_driver_sql('VACUUM')
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
 def main():
-    # Creates blank database file
+    # Creates blank database file, or adds any missing tables, columns and indexes
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    create_indexes(engine)
 
 
 if __name__ == '__main__':
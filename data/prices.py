@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from build.aggregate import BIDDER_CATEGORIES
+from build.metrics import metrics
+from data.model import BidAggregate, Session
+
+
+def get_aggregate_signature(session: Session) -> tuple:
+    '''Returns the row count and column sums of the aggregate table, which change
+    whenever abstracts are loaded, refreshed or removed.'''
+    statement = select(
+        func.count(),
+        func.total(BidAggregate.Occurrences),
+        func.total(BidAggregate.TotalPriceSum),
+        func.total(BidAggregate.QuantitySum)
+    ).select_from(BidAggregate)
+    return tuple(session.execute(statement).one())
+
+
+def get_aggregate_rows(session: Session) -> pd.DataFrame:
+    '''Returns every row of the aggregate table ordered by ItemID.'''
+    statement = select(
+        BidAggregate.ItemID,
+        BidAggregate.Year,
+        BidAggregate.BidderCategory,
+        BidAggregate.District,
+        BidAggregate.County,
+        BidAggregate.TotalPriceSum,
+        BidAggregate.QuantitySum,
+        BidAggregate.Occurrences
+    ).order_by(BidAggregate.ItemID)
+    return pd.read_sql(statement, con=session.connection())
+
+
+class PriceIndex():
+    '''Answers weighted unit price lookups for an item filtered by any mix of
+    Year, District, County and bidder category from an in-memory copy of the
+    BidAggregate table.
+
+    The aggregates are held as arrays sliced by ItemID, so a lookup only sums the
+    rows of one item, and results are kept in an LRU cache of cache_size entries.
+    Like UniqueItemSet the table is loaded on first use, checked for changes at
+    most every check_interval seconds (or immediately after invalidate()) and
+    reloaded, emptying the cache, when it has changed.
+
+    A reload publishes the slices and arrays together as one snapshot, which each
+    lookup reads once, and moves to a new generation. A result computed from an
+    older generation is returned but not cached.'''
+
+    def __init__(self, check_interval: float = 30, cache_size: int = 4096) -> None:
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.signature = None
+        self.checked_at = None
+        self.cache = OrderedDict()
+        self.generation = 0
+        self.snapshot = None
+
+
+    def invalidate(self):
+        '''Forces the aggregate table to be checked for changes on next use.'''
+        with self.lock:
+            self.generation += 1
+            self.checked_at = None
+
+
+    def load(self):
+        # Lock free when recently checked, since this runs on every lookup
+        checked_at = self.checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.check_interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return
+
+            with Session() as session:
+                signature = get_aggregate_signature(session)
+                if signature != self.signature or self.snapshot is None:
+                    self.snapshot = self.build(get_aggregate_rows(session))
+                    self.generation += 1
+                    self.cache.clear()
+                    self.signature = signature
+            self.checked_at = now
+
+
+    def build(self, agg_df: pd.DataFrame) -> tuple[dict, dict]:
+        '''Splits the aggregate rows into the slice of each ItemID and per-column arrays.'''
+        item_ids = agg_df['ItemID'].to_numpy(dtype='int64')
+        starts = np.flatnonzero(np.r_[True, item_ids[1:] != item_ids[:-1]]) if len(item_ids) else []
+        ends = np.r_[starts[1:], len(item_ids)] if len(item_ids) else []
+        slices = {int(item_ids[s]): slice(int(s), int(e)) for s, e in zip(starts, ends)}
+        columns = {
+            'Year': agg_df['Year'].to_numpy(dtype='int64'),
+            'BidderCategory': pd.Categorical(agg_df['BidderCategory'], categories=BIDDER_CATEGORIES).codes,
+            'District': agg_df['District'].to_numpy(dtype='object'),
+            'County': agg_df['County'].to_numpy(dtype='object'),
+            'TotalPriceSum': agg_df['TotalPriceSum'].to_numpy(dtype='float64'),
+            'QuantitySum': agg_df['QuantitySum'].to_numpy(dtype='float64'),
+            'Occurrences': agg_df['Occurrences'].to_numpy(dtype='int64')
+        }
+        return slices, columns
+
+
+    def weighted_prices(self, item_id: int, year: Optional[int] = None, district: Optional[str] = None,
+                        county: Optional[str] = None, bidder_category: Optional[str] = None) -> tuple[dict]:
+        '''Returns the contract occurrences and weighted unit price of item_id for each
+        (Year, BidderCategory) matching the filters, newest year first. A filter of None
+        matches everything. The returned records are shared with the cache and must not
+        be modified.'''
+        if bidder_category is not None and bidder_category not in BIDDER_CATEGORIES:
+            raise ValueError(f'bidder_category must be one of {", ".join(BIDDER_CATEGORIES)}')
+
+        self.load()
+        key = (item_id, year, district, county, bidder_category)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                metrics.inc('price_cache_hits_total')
+                return result
+            generation, snapshot = self.generation, self.snapshot
+
+        metrics.inc('price_cache_misses_total')
+        result = self.compute(snapshot, item_id, year, district, county, bidder_category)
+        with self.lock:
+            # Invalidated or reloaded while computing, so the result may be stale
+            if self.generation != generation:
+                return result
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+
+    def compute(self, snapshot: tuple[dict, dict], item_id: int, year: Optional[int],
+                district: Optional[str], county: Optional[str], bidder_category: Optional[str]) -> tuple[dict]:
+        slices, all_columns = snapshot
+        item_slice = slices.get(item_id)
+        if item_slice is None:
+            return ()
+        columns = {name: values[item_slice] for name, values in all_columns.items()}
+
+        keep = np.ones(item_slice.stop - item_slice.start, dtype=bool)
+        if year is not None:
+            keep &= columns['Year'] == year
+        if district is not None:
+            keep &= columns['District'] == district
+        if county is not None:
+            keep &= columns['County'] == county
+        if bidder_category is not None:
+            keep &= columns['BidderCategory'] == BIDDER_CATEGORIES.index(bidder_category)
+        if not keep.any():
+            return ()
+
+        # Sum the matching locations of each (Year, BidderCategory), newest year first
+        category_count = len(BIDDER_CATEGORIES)
+        group = -columns['Year'][keep] * category_count + columns['BidderCategory'][keep]
+        groups, codes = np.unique(group, return_inverse=True)
+        total_price = np.bincount(codes, weights=columns['TotalPriceSum'][keep])
+        quantity = np.bincount(codes, weights=columns['QuantitySum'][keep])
+        occurrences = np.bincount(codes, weights=columns['Occurrences'][keep])
+
+        records = []
+        for i, g in enumerate(groups.tolist()):
+            category = g % category_count
+            records.append({
+                'ItemID': item_id,
+                'Year': (category - g) // category_count,
+                'BidderCategory': BIDDER_CATEGORIES[category],
+                'ContractOccurrence': int(occurrences[i]),
+                'WeightedUnitPrice': round(total_price[i] / quantity[i], 2) if quantity[i] else None
+            })
+        return tuple(records)
+
+
+# Initialize an instance of PriceIndex to import into the modules that use it.
+# No database queries are made until it is first used.
+price_index = PriceIndex()
@@ -0,0 +1,135 @@
+'''Bid price storage modes.
+
+wide    the Bid table holds the engineer's and first three bidders' prices in
+        <category>_UnitPrice and _TotalPrice columns (the default)
+long    the BidPrice table holds one row per bid and bidder rank in integer cents,
+        for every bidder, and ContractBidder the bidders of each contract. The Bid
+        price columns and Contract bidder columns are dropped.
+
+The mode is stored in the Setting table, so every process writing to or reading
+from a database agrees on where the prices are.'''
+
+from sqlalchemy import (Column, ForeignKey, Integer, MetaData, Table, cast, delete, func, insert,
+                        inspect, literal, select)
+from sqlalchemy.engine import Connection, Engine
+from data.model import Base, Bid, BidPrice, Contract, ContractBidder, Setting, create_indexes, engine
+
+
+WIDE = 'wide'
+LONG = 'long'
+STORAGE_SETTING = 'BidStorage'
+
+# Rank of the engineer's estimate in BidPrice, the bidders are ranked from 0
+ENGINEER_RANK = -1
+
+# The Bid price columns and the Contract bidder columns of wide storage by rank
+WIDE_RANKS = {ENGINEER_RANK: 'Engineer', 0: 'BidderID_0', 1: 'BidderID_1', 2: 'BidderID_2'}
+
+# Columns of each table that only exist with wide storage
+WIDE_COLUMNS = {
+    Bid.__tablename__: tuple(f'{category}_{price}' for category in WIDE_RANKS.values()
+                             for price in ('UnitPrice', 'TotalPrice')),
+    Contract.__tablename__: tuple(WIDE_RANKS[rank] for rank in (0, 1, 2))
+}
+
+
+def get_bid_storage(conn: Connection) -> str:
+    '''Returns the bid storage mode of the database, wide unless it was migrated.'''
+    if not conn.dialect.has_table(conn, Setting.__tablename__):
+        return WIDE
+    statement = select(Setting.Value).where(Setting.Name==STORAGE_SETTING)
+    return conn.execute(statement).scalar() or WIDE
+
+
+def set_bid_storage(conn: Connection, storage: str):
+    conn.execute(delete(Setting).where(Setting.Name==STORAGE_SETTING))
+    conn.execute(insert(Setting).values(Name=STORAGE_SETTING, Value=storage))
+
+
+def to_cents(price):
+    '''Rounds a price column to whole cents.'''
+    return cast(func.round(price * 100), Integer)
+
+
+def drop_columns(conn: Connection, table: Table, columns: tuple[str]):
+    '''Recreates table without columns and copies its rows over. SQLite can only drop
+    a column in place from 3.35 on, and never one with a foreign key like the Contract
+    bidder columns. The primary key is not given the redundant UNIQUE index of the
+    declared unique=True, and the declared indexes are recreated.'''
+    # The referenced tables are copied so the foreign keys of the new table resolve
+    metadata = MetaData()
+    for referenced in Base.metadata.sorted_tables:
+        referenced.to_metadata(metadata)
+
+    kept = [column for column in table.columns if column.name not in columns]
+    rebuilt = Table(table.name + '_rebuilt', metadata, *[
+        Column(column.name, column.type, *[ForeignKey(key.target_fullname) for key in column.foreign_keys],
+               primary_key=column.primary_key)
+        for column in kept
+    ])
+    rebuilt.create(conn)
+    names = [column.name for column in kept]
+    conn.execute(insert(rebuilt).from_select(names, select(*kept)))
+    table.drop(conn)
+    conn.exec_driver_sql(f'ALTER TABLE "{rebuilt.name}" RENAME TO "{table.name}"')
+    for index in table.indexes:
+        index.create(conn)
+
+
+def drop_wide_columns(conn: Connection) -> bool:
+    '''Drops the wide storage columns left in the Bid and Contract tables of a long
+    storage database, e.g. by create_all() recreating the tables. Returns False if there
+    were none.'''
+    if get_bid_storage(conn) != LONG:
+        return False
+
+    dropped = False
+    inspector = inspect(conn)
+    for table_name, columns in WIDE_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table_name)}
+        if existing.intersection(columns):
+            drop_columns(conn, Base.metadata.tables[table_name], columns)
+            dropped = True
+    return dropped
+
+
+def migrate_to_long_storage(bind: Engine = engine) -> bool:
+    '''Copies the Bid price columns and Contract bidders into the BidPrice and
+    ContractBidder tables, drops the wide columns and switches the database to long
+    storage. Bids need both a unit and a total price to be copied, and prices are
+    rounded to whole cents. The dropped columns only give their space back once the
+    database is vacuumed. Returns False if the database already had long storage.'''
+    Base.metadata.create_all(bind, tables=[Setting.__table__, BidPrice.__table__,
+                                           ContractBidder.__table__])
+    create_indexes(bind)
+
+    with bind.begin() as conn:
+        if get_bid_storage(conn) == LONG:
+            return False
+
+        for rank, category in WIDE_RANKS.items():
+            unit_price = getattr(Bid, category + '_UnitPrice')
+            total_price = getattr(Bid, category + '_TotalPrice')
+            prices = select(
+                Bid.BidID, literal(rank), to_cents(unit_price), to_cents(total_price)
+            ).where(unit_price.is_not(None), total_price.is_not(None))
+            conn.execute(
+                insert(BidPrice).
+                from_select(['BidID', 'Rank', 'UnitPriceCents', 'TotalPriceCents'], prices).
+                prefix_with('OR IGNORE')
+            )
+            if rank == ENGINEER_RANK:
+                continue
+
+            bidder_id = getattr(Contract, category)
+            bidders = select(Contract.ContractID, literal(rank), bidder_id).where(bidder_id.is_not(None))
+            conn.execute(
+                insert(ContractBidder).
+                from_select(['ContractID', 'Rank', 'BidderID'], bidders).
+                prefix_with('OR IGNORE')
+            )
+
+        set_bid_storage(conn, LONG)
+        drop_wide_columns(conn)
+
+    return True
@@ -1,49 +1,101 @@
+import threading
+import time
+import numpy as np
 from data.model import Session, Item2020, Item2018
-from sqlalchemy import select
+from sqlalchemy import func, literal, select, union_all
 
 
 def get_unique_id_set_2018(session: Session):
     '''Get a set of unique ItemIDs (int) for spec year 2018'''
-    subq = (
-        select(Item2018.ItemID_2018).
-        where(Item2018.ItemID_2018 == Item2020.ItemID_2020)
-    ).exists()
-
-    statement = select(Item2018.ItemID_2018).where(~subq)
-    result = session.execute(statement)
-
-    unique_ids = set()
-    for id in result.scalars():
-        unique_ids.add(id)
-
-    return unique_ids
+    return get_unique_id_sets(session)[2018]
 
 
 def get_unique_id_set_2020(session: Session):
     '''Get a set of unique ItemIDs (int) for spec year 2020'''
-    subq = (
-        select(Item2020.ItemID_2020).
-        where(Item2018.ItemID_2018 == Item2020.ItemID_2020)
-    ).exists()
+    return get_unique_id_sets(session)[2020]
+
+
+def get_unique_id_sets(session: Session) -> dict[int, set]:
+    '''Get the sets of ItemIDs (int) that only occur in each spec year with a single
+    query of two anti-joins.'''
+    only_2018 = (
+        select(Item2018.ItemID_2018, literal(2018)).
+        outerjoin(Item2020, Item2018.ItemID_2018 == Item2020.ItemID_2020).
+        where(Item2020.ItemID_2020.is_(None))
+    )
+    only_2020 = (
+        select(Item2020.ItemID_2020, literal(2020)).
+        outerjoin(Item2018, Item2020.ItemID_2020 == Item2018.ItemID_2018).
+        where(Item2018.ItemID_2018.is_(None))
+    )
+    result = session.execute(union_all(only_2018, only_2020))
+
+    unique_ids = {2018: set(), 2020: set()}
+    for id, spec_year in result:
+        unique_ids[spec_year].add(id)
 
-    statement = select(Item2020.ItemID_2020).where(~subq)
-    result = session.execute(statement)
+    return unique_ids
 
-    unique_ids = set()
-    for id in result.scalars():
-        unique_ids.add(id)
 
-    return unique_ids
+def get_item_table_signature(session: Session) -> tuple:
+    '''Returns the row count and max ItemID of both item tables, which changes
+    whenever items are added to or removed from either table.'''
+    statement = select(
+        select(func.count()).select_from(Item2018).scalar_subquery(),
+        select(func.max(Item2018.ItemID_2018)).scalar_subquery(),
+        select(func.count()).select_from(Item2020).scalar_subquery(),
+        select(func.max(Item2020.ItemID_2020)).scalar_subquery()
+    )
+    return tuple(session.execute(statement).one())
 
 
 class UniqueItemSet():
     '''Contains two sets, one for each spec year, of ItemIDs that only occur in
-    that spec year.'''
+    that spec year.
+
+    The sets are loaded from the database on first use rather than at import and
+    are reloaded when the item tables change. The tables are checked at most once
+    every check_interval seconds, or immediately after invalidate().'''
+
+    def __init__(self, check_interval: float = 30) -> None:
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.signature = None
+        self.checked_at = None
+        self._unique_ids = None
+        self._sorted_ids_2018 = None
+
 
-    def __init__(self) -> None:
-        with Session() as session:
-            self.unique_ids_2020 = get_unique_id_set_2020(session)
-            self.unique_ids_2018 = get_unique_id_set_2018(session)
+    def invalidate(self):
+        '''Forces the item tables to be checked for changes on next use.'''
+        self.checked_at = None
+
+
+    def load(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is not None and now - self.checked_at < self.check_interval:
+                return
+
+            with Session() as session:
+                signature = get_item_table_signature(session)
+                if signature != self.signature or self._unique_ids is None:
+                    self._unique_ids = get_unique_id_sets(session)
+                    self._sorted_ids_2018 = np.array(sorted(self._unique_ids[2018]), dtype='int64')
+                    self.signature = signature
+            self.checked_at = now
+
+
+    @property
+    def unique_ids_2018(self) -> set:
+        self.load()
+        return self._unique_ids[2018]
+
+
+    @property
+    def unique_ids_2020(self) -> set:
+        self.load()
+        return self._unique_ids[2020]
 
 
     def exists(self, item_id: int, spec_year: int):
@@ -59,5 +111,14 @@ class UniqueItemSet():
         else:
             return 2020
 
-# Initialize an instance of UniqueItemSet to import into the modules that use it
-unique_item_set = UniqueItemSet()
\ No newline at end of file
+
+    def get_spec_years(self, item_ids) -> np.ndarray:
+        '''Vectorized get_spec_year: returns an array of 2018 or 2020 for an array of ItemIDs.'''
+        self.load()
+        item_ids = np.asarray(item_ids, dtype='int64')
+        is_2018 = np.isin(item_ids, self._sorted_ids_2018, assume_unique=False)
+        return np.where(is_2018, 2018, 2020)
+
+# Initialize an instance of UniqueItemSet to import into the modules that use it.
+# No database queries are made until it is first used.
+unique_item_set = UniqueItemSet()
@@ -1,106 +1,339 @@
+import contextlib
+import sys
 import pandas as pd
-from data.model import engine, Item, Bid, Contract
-from sqlalchemy import select
-
-
-def get_df_by_year(bid_df: pd.DataFrame, year: int) -> pd.DataFrame:
-    '''Returns a dataframe filtered by year.'''
-    filt = bid_df['Year'] == year
-    return bid_df[filt].copy()
-
-
-def filter_by_bidder(bid_year_df: pd.DataFrame, bidder_category: str):
-    '''Returns a GroupBy object filtered by bidder_category and grouped by ItemID.
-    bidder_category options: "Engineer", "BidderID_0", "BidderID_1", "BidderID_2".'''
-
-    column = bidder_category + '_TotalPrice'
-    filt = bid_year_df[column].notna()  # filter df_in for specified bidder
-    filt_df = bid_year_df[filt]
-
-    return filt_df.groupby(['ItemID'])
-
-
-def calc_contract_occur(bid_year_df: pd.DataFrame, bidder_category: str):
-    '''Returns a series of the contract occurrence count for all items for a given bidder_category.
-    bidder_category options: "Engineer", "BidderID_0", "BidderID_1", "BidderID_2".'''
-
-    column = bidder_category + '_TotalPrice'
-    grp = filter_by_bidder(bid_year_df, bidder_category)
-
-    return grp[column].count()
-
-
-def calc_weighted_avg(bid_year_df: pd.DataFrame, bidder_category: str):
-    '''Returns the weighted average for all items for a given bidder_category.
-    bidder_category options: "Engineer", "BidderID_0", "BidderID_1", "BidderID_2".'''
-
-    column = bidder_category + '_TotalPrice'
-    grp = filter_by_bidder(bid_year_df, bidder_category)
-
-    return (grp[column].sum() / grp['Quantity'].sum()).round(2)
-
-
-def get_weighted_avg_by_year(item_df: pd.DataFrame, bid_df: pd.DataFrame, year: int) -> pd.DataFrame:
-    '''Returns dataframe of weighted average unit prices and contract occurrences
-    for each bidder_category.'''
-
-    bidder_category = ['Engineer', 'BidderID_0', 'BidderID_1', 'BidderID_2']
-    bid_year_df = get_df_by_year(bid_df=bid_df, year=year)
-    df = pd.DataFrame(index=item_df.index.to_series())
-
-    for bidder in bidder_category:
-        contract_occur_column = str(year) + '_' + bidder + '_ContractOccurrence'
-        weighted_uprice_column = str(year) + '_' + bidder + '_WeightedUnitPrice'
-
-        df[contract_occur_column] = calc_contract_occur(bid_year_df, bidder)
-        df[weighted_uprice_column] = calc_weighted_avg(bid_year_df, bidder)
-
-    return df
-
+from typing import Iterable, Optional
+from build.aggregate import BIDDER_CATEGORIES, CATEGORY_RANKS
+from build.metrics import metrics
+from build.price_stats import (DEFAULT_PERCENTILES, DEFAULT_TRIM, aggregate_bid_stats, melt_bids,
+                               pivot_stats, wide_columns)
+from build.writer import BinaryIndexChunkWriter, open_chunk_writer
+from data.analytics import read_sql_chunks_duckdb
+from data.model import engine, Item2018, Bid, BidAggregate, BidPrice, Contract
+from data.storage import LONG, WIDE, get_bid_storage
+from sqlalchemy import case, func, literal, select, union_all
+
+
+# Statistics exported by the weighted average exports, per year and bidder category
+WEIGHTED_AVG_STATS = ['ContractOccurrence', 'WeightedUnitPrice']
+
+
+def create_weighted_avg_df(item_df: pd.DataFrame, long_df: pd.DataFrame) -> pd.DataFrame:
+    '''Returns item_df joined to the contract occurrences and weighted unit prices of
+    every year in long_df, the bids in the long form of melt_bids, computed with a
+    single groupby.'''
+    stats_df = aggregate_bid_stats(long_df, order_statistics=False)
+    return item_df.join(pivot_stats(stats_df, stats=WEIGHTED_AVG_STATS))
+
+
+def weighted_avg_columns(years: list[int]) -> list[str]:
+    '''Returns the output column names in year, bidder_category order.'''
+    return wide_columns(years, WEIGHTED_AVG_STATS)
+
+
+def get_years(conn, source: str = 'aggregates') -> list[int]:
+    '''Returns the letting years with bids, newest first.'''
+    year = BidAggregate.Year if source == 'aggregates' else Contract.Year
+    statement = select(year).distinct().order_by(year.desc())
+    return list(conn.execute(statement).scalars())
+
+
+def select_aggregate_totals(district: Optional[str] = None, county: Optional[str] = None):
+    '''Returns a select of the BidAggregate running totals summed over location, optionally
+    restricted to a single district and/or county, ordered by ItemID.'''
+    statement = (
+        select(
+            BidAggregate.ItemID,
+            BidAggregate.Year,
+            BidAggregate.BidderCategory,
+            func.sum(BidAggregate.TotalPriceSum).label('TotalPriceSum'),
+            func.sum(BidAggregate.QuantitySum).label('QuantitySum'),
+            func.sum(BidAggregate.Occurrences).label('Occurrences')
+        ).
+        group_by(BidAggregate.ItemID, BidAggregate.Year, BidAggregate.BidderCategory).
+        order_by(BidAggregate.ItemID)
+    )
+    if district is not None:
+        statement = statement.where(BidAggregate.District==district)
+    if county is not None:
+        statement = statement.where(BidAggregate.County==county)
+
+    return statement
+
+
+def select_bid_price_totals(district: Optional[str] = None, county: Optional[str] = None):
+    '''Returns select_bid_totals for long bid storage, grouping the BidPrice rows of the
+    bidder category ranks in one pass.'''
+    category = case({rank: category for category, rank in CATEGORY_RANKS.items()},
+                    value=BidPrice.Rank)
+    statement = (
+        select(
+            Bid.ItemID,
+            Contract.Year,
+            category.label('BidderCategory'),
+            (func.sum(BidPrice.TotalPriceCents) / 100.0).label('TotalPriceSum'),
+            func.sum(Bid.Quantity).label('QuantitySum'),
+            func.count().label('Occurrences')
+        ).
+        join(BidPrice, onclause=BidPrice.BidID==Bid.BidID).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+        where(BidPrice.Rank.in_(CATEGORY_RANKS.values())).
+        group_by(Bid.ItemID, Contract.Year, BidPrice.Rank).
+        order_by(Bid.ItemID)
+    )
+    if district is not None:
+        statement = statement.where(Contract.District==district)
+    if county is not None:
+        statement = statement.where(Contract.County==county)
+
+    return statement
+
+
+def select_bid_totals(district: Optional[str] = None, county: Optional[str] = None,
+                      storage: str = WIDE):
+    '''Returns a select that computes the same totals as select_aggregate_totals directly
+    from the Bid table, or the BidPrice table with long storage, with the filtering and
+    grouping done by the database.'''
+    if storage == LONG:
+        return select_bid_price_totals(district, county)
+
+    selects = []
+    for bidder in BIDDER_CATEGORIES:
+        total_price = getattr(Bid, bidder + '_TotalPrice')
+        statement = (
+            select(
+                Bid.ItemID,
+                Contract.Year,
+                literal(bidder).label('BidderCategory'),
+                func.sum(total_price).label('TotalPriceSum'),
+                func.sum(Bid.Quantity).label('QuantitySum'),
+                func.count(total_price).label('Occurrences')
+            ).
+            join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+            where(total_price.is_not(None)).
+            group_by(Bid.ItemID, Contract.Year)
+        )
+        if district is not None:
+            statement = statement.where(Contract.District==district)
+        if county is not None:
+            statement = statement.where(Contract.County==county)
+        selects.append(statement)
+
+    totals = union_all(*selects).subquery()
+    return select(totals).order_by(totals.c.ItemID)
+
+
+def get_aggregate_df(conn, district: Optional[str] = None, county: Optional[str] = None) -> pd.DataFrame:
+    '''Returns the BidAggregate running totals summed over location, optionally
+    restricted to a single district and/or county.'''
+    return pd.read_sql(select_aggregate_totals(district, county), con=conn)
+
+
+def pivot_totals(totals_df: pd.DataFrame, years: list[int]) -> pd.DataFrame:
+    '''Pivots long (ItemID, Year, BidderCategory) totals into one row per ItemID of
+    contract occurrences and weighted unit prices for each of years.'''
+    if totals_df.empty:
+        return pd.DataFrame(columns=weighted_avg_columns(years), dtype='float64')
+
+    totals_df = totals_df.set_index(['ItemID', 'Year', 'BidderCategory'])
+    stats = pd.DataFrame({
+        'ContractOccurrence': totals_df['Occurrences'],
+        'WeightedUnitPrice': (totals_df['TotalPriceSum'] / totals_df['QuantitySum']).round(2)
+    })
+    wide = stats.unstack(['Year', 'BidderCategory'])
+    wide.columns = [f'{year}_{bidder}_{stat}' for stat, year, bidder in wide.columns]
+
+    return wide.reindex(columns=weighted_avg_columns(years)).astype('float64')
+
+
+def create_weighted_avg_df_from_aggregates(item_df: pd.DataFrame, agg_df: pd.DataFrame) -> pd.DataFrame:
+    '''Returns the same columns as create_weighted_avg_df computed from the aggregate totals.'''
+    years = sorted(agg_df['Year'].unique().tolist(), reverse=True)
+    return item_df.join(pivot_totals(agg_df, years))
+
+
+def iter_weighted_avg_chunks(item_df: pd.DataFrame, totals_chunks: Iterable[pd.DataFrame],
+                             years: list[int]):
+    '''Consumes chunks of a totals select ordered by ItemID and yields the matching slices
+    of item_df joined to their weighted averages. Only one chunk of totals is held in
+    memory, so memory does not grow with the number of bids.'''
+    item_df = item_df.sort_index()
+    item_position = 0
+    carry = None
+
+    def items_through(item_id, totals_df) -> pd.DataFrame:
+        nonlocal item_position
+        end = item_df.index.searchsorted(item_id, side='right')
+        items = item_df.iloc[item_position:end]
+        item_position = end
+        return items.join(pivot_totals(totals_df, years))
+
+    for chunk in totals_chunks:
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+
+        # Hold back the last item since its rows may continue in the next chunk
+        last_item_id = chunk['ItemID'].iloc[-1]
+        is_last_item = chunk['ItemID'] == last_item_id
+        carry = chunk[is_last_item]
+        complete = chunk[~is_last_item]
+        if not complete.empty:
+            yield items_through(complete['ItemID'].iloc[-1], complete)
+
+    if carry is None:
+        carry = pd.DataFrame()
+    remaining = item_df.iloc[item_position:]
+    if not remaining.empty:
+        yield remaining.join(pivot_totals(carry, years))
+
+
+def get_item_df(conn) -> pd.DataFrame:
+    '''Returns the spec year 2018 item list indexed by ItemID.'''
+    item_select = select(
+        Item2018.ItemID_2018.label('ItemID'),
+        Item2018.Description_2018.label('Description'),
+        Item2018.Unit_2018.label('Unit')
+    )
+    return pd.read_sql(item_select, con=conn, index_col='ItemID')
+
+
+def get_bid_df(conn, district: Optional[str] = None, county: Optional[str] = None) -> pd.DataFrame:
+    '''Returns the quantity and prices of every bid with its letting year, optionally
+    restricted to a single district and/or county.'''
+    price_columns = [getattr(Bid, f'{bidder}_{price}') for bidder in BIDDER_CATEGORIES
+                     for price in ('UnitPrice', 'TotalPrice')]
+    bid_select = (
+        select(Bid.ItemID, Contract.Year, Bid.Quantity, *price_columns).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID)
+    )
+    if district is not None:
+        bid_select = bid_select.where(Contract.District==district)
+    if county is not None:
+        bid_select = bid_select.where(Contract.County==county)
+    return pd.read_sql(bid_select, con=conn)
+
+
+def get_long_bid_df(conn, district: Optional[str] = None, county: Optional[str] = None) -> pd.DataFrame:
+    '''Returns the bids in the long form of melt_bids, one row per bid and bidder
+    category with a price. With long bid storage the rows are read as they are stored.'''
+    if get_bid_storage(conn) == WIDE:
+        return melt_bids(get_bid_df(conn, district=district, county=county))
+
+    bid_select = (
+        select(
+            Bid.ItemID,
+            Contract.Year,
+            BidPrice.Rank,
+            Bid.Quantity,
+            (BidPrice.UnitPriceCents / 100.0).label('UnitPrice'),
+            (BidPrice.TotalPriceCents / 100.0).label('TotalPrice')
+        ).
+        join(BidPrice, onclause=BidPrice.BidID==Bid.BidID).
+        join(Contract, onclause=Bid.ContractID==Contract.ContractID).
+        where(BidPrice.Rank.in_(CATEGORY_RANKS.values()))
+    )
+    if district is not None:
+        bid_select = bid_select.where(Contract.District==district)
+    if county is not None:
+        bid_select = bid_select.where(Contract.County==county)
+    long_df = pd.read_sql(bid_select, con=conn)
+
+    ranks = [CATEGORY_RANKS[category] for category in BIDDER_CATEGORIES]
+    codes = pd.Series(range(len(ranks)), index=ranks)
+    categories = pd.Categorical.from_codes(codes[long_df.pop('Rank')].to_numpy(),
+                                           categories=BIDDER_CATEGORIES)
+    long_df.insert(2, 'BidderCategory', categories)
+    return long_df
+
+
+def export_bid_statistics(filename: str, district: Optional[str] = None, county: Optional[str] = None,
+                          percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+                          trim: float = DEFAULT_TRIM) -> int:
+    '''Exports the weighted average, contract occurrences, median, percentiles and
+    trimmed mean unit price of each item per year and bidder category, computed from
+    every bid in one pass. Returns the number of rows written.'''
+    with engine.connect() as conn:
+        item_df = get_item_df(conn)
+        long_df = get_long_bid_df(conn, district=district, county=county)
 
-def create_weighted_avg_df(item_df: pd.DataFrame, bid_df: pd.DataFrame) -> pd.DataFrame:
-    years = [2021, 2020, 2019, 2018]
-    df = item_df.copy()
+    with metrics.timer('export_seconds', source='statistics', backend='sqlite'):
+        stats_df = aggregate_bid_stats(long_df, percentiles=percentiles, trim=trim)
+        del long_df
+        df = item_df.join(pivot_stats(stats_df))
+        with open_chunk_writer(filename) as writer:
+            writer.write(df)
 
-    for year in years:
-        wt_avg_year_df = get_weighted_avg_by_year(
-            item_df=item_df,
-            bid_df=bid_df,
-            year=year
-        )
-        df = df.join(wt_avg_year_df)
-    return df
+    metrics.inc('rows_exported_total', writer.row_count)
+    return writer.row_count
 
 
-def export_weighted_avg_to_csv(filename: str):
+def export_weighted_avg_to_csv(filename: str, from_aggregates: bool = True,
+                               district: Optional[str] = None, county: Optional[str] = None):
+    '''Exports weighted averages to csv. By default reads the small BidAggregate tables;
+    with from_aggregates=False every bid is read and the averages are recomputed.'''
     with engine.connect() as conn:
         # create item list dataframe
-        item_select = select(Item.ItemID, Item.Description, Item.Unit)
-        item_df = pd.read_sql(item_select, con=conn, index_col='ItemID')
+        item_df = get_item_df(conn)
 
-        # create bid data dataframe
-        bid_select = (
-            select(
-                Bid,
-                Contract.Year,
-                Contract.District,
-                Contract.County,
-            ).
-            join(Contract, onclause=Bid.ContractID==Contract.ContractID)
-        )
-        bid_df = pd.read_sql(bid_select, con=conn)
-
-    # create weighted average dataframe
-    df = create_weighted_avg_df(item_df=item_df, bid_df=bid_df)
+        if from_aggregates:
+            agg_df = get_aggregate_df(conn, district=district, county=county)
+            df = create_weighted_avg_df_from_aggregates(item_df=item_df, agg_df=agg_df)
+        else:
+            long_df = get_long_bid_df(conn, district=district, county=county)
+            df = create_weighted_avg_df(item_df=item_df, long_df=long_df)
 
     # export weighted average dataframe to csv
     df.to_csv(filename)
 
 
+def export_weighted_avg(filename: str, source: str = 'aggregates', chunksize: int = 10000,
+                        district: Optional[str] = None, county: Optional[str] = None,
+                        backend: str = 'sqlite', index_filename: Optional[str] = None) -> int:
+    '''Exports weighted averages with bounded memory by pushing the grouping into SQL and
+    writing the result in chunks. source is "aggregates" (BidAggregate table) or "bids"
+    (Bid table). backend "duckdb" runs the grouping query on DuckDB against the SQLite
+    file. Writes gzip csv for .csv.gz and parquet for .parquet filenames, and also a
+    memory-mappable binary price index to index_filename if given.
+    Returns the number of rows written.'''
+    if source not in ('aggregates', 'bids'):
+        raise ValueError(f'Unknown source: {source}')
+
+    with engine.connect() as conn:
+        if source == 'aggregates':
+            statement = select_aggregate_totals(district, county)
+        else:
+            statement = select_bid_totals(district, county, storage=get_bid_storage(conn))
+        item_df = get_item_df(conn)
+        years = get_years(conn, source)
+
+        if backend == 'duckdb':
+            totals_chunks = read_sql_chunks_duckdb(statement, chunksize)
+        else:
+            conn = conn.execution_options(stream_results=True)
+            totals_chunks = pd.read_sql(statement, con=conn, chunksize=chunksize)
+
+        with metrics.timer('export_seconds', source=source, backend=backend):
+            with contextlib.ExitStack() as stack:
+                writers = [stack.enter_context(open_chunk_writer(filename))]
+                if index_filename is not None:
+                    writers.append(stack.enter_context(BinaryIndexChunkWriter(index_filename)))
+                writer = writers[0]
+                for chunk_df in iter_weighted_avg_chunks(item_df, totals_chunks, years):
+                    with metrics.timer('export_write_seconds'):
+                        for chunk_writer in writers:
+                            chunk_writer.write(chunk_df)
+
+    metrics.inc('rows_exported_total', writer.row_count)
+    metrics.event('export_complete', filename=filename, rows=writer.row_count)
+    return writer.row_count
+
+
 def main():
-    filename = 'exports/Spec2018_weighted_average_all.csv'
-    export_weighted_avg_to_csv(filename=filename)
+    # The arguments are defined with the other subcommands of the command line interface
+    from cli import main as cli_main
+    cli_main(['export', *sys.argv[1:]])
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
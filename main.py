@@ -1,24 +1,28 @@
-import build.db as db
-import build.scraper as scraper
-import build.processor as processor
-import weightedavg
+from build.cache import AbstractCache
+from create_database_tables import create_database_tables
+from export_weighted_avg_csv import export_weighted_avg
+from process_abstracts import process_abstracts
+from scrape_abstract_ids import scrape_abstract_ids_for_years
 
-'''Builds a populated database from scratch.'''
+'''Builds a populated database from scratch, or brings an existing one up to date.'''
 
-# Build the empty database
-db.create_all_tables()
 
-# Populate item table
-item_csv = 'data/2018_TrnsportItemList.csv'
-db.csv_to_item_table(item_csv)
+def main():
+    # Build the database tables and populate the item tables
+    create_database_tables()
 
-# Scrape abstracts for years 2018-2021
-years = ['2021', '2020', '2019', '2018']
-for year in years:
-    scraper.main(year)
+    # Scrape abstracts for years 2018-2021
+    years = [2021, 2020, 2019, 2018]
+    scrape_abstract_ids_for_years(years)
 
-# Process all scraped abstracts
-processor.main()
+    # Fetch, parse and load every unprocessed abstract. Safe to re-run after an
+    # interruption since only abstracts not yet marked processed are loaded.
+    process_abstracts(cache=AbstractCache())
 
-# Compute weighted average and output to csv
-weightedavg.main()
\ No newline at end of file
+    # Compute weighted average and output to csv, with a binary index for estimating tools
+    export_weighted_avg('exports/Spec2018_weighted_average_all.csv',
+                        index_filename='exports/Spec2018_weighted_average_all.idx')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
-from sqlalchemy import select, update
-from build.abstract import AbstractData
-from build.table import BidTable, BidderTable, ContractTable
-from data.model import Bid, Bidder, Session, Abstract, Contract
+import sys
+from sqlalchemy import inspect, select, update
+from build.cache import AbstractCache
+from build.claims import WorkQueue
+from build.metrics import PipelineStats
+from data.model import (Base, Bid, BidAggregate, Bidder, BidPrice, Session, Abstract, Contract,
+                        ContractBidder, add_missing_columns, create_indexes, engine)
+from data.storage import drop_wide_columns
 
 
 def get_unprocessed_abstract_ids(session: Session) -> list:
@@ -16,51 +20,118 @@ def get_unprocessed_abstract_ids(session: Session) -> list:
     return unprocessed_abstract_ids
 
 
-with Session() as session:
-
-    unprocessed_abstract_ids = get_unprocessed_abstract_ids(session)
-
-    for abstract_id in unprocessed_abstract_ids[:5]: # Set to only process 5 for testing purposes
-        print(f'{abstract_id}')
-        print('   Retrieving data')
-        try:
-            # Create table objects 
-            abstract_data = AbstractData(abstract_id)
-            contract_table = ContractTable(abstract_data)
-            bid_table = BidTable(abstract_data)
-            bidder_table = BidderTable(abstract_data)
-            print('   Retrieval complete')
-
-            # Insert table objects into database
-            # Uses session.get() to avoid inserting duplicate records
-            print('   Loading into database')
-            for record in contract_table.records:
-                if session.get(Contract, ident=record.ContractID) is None:
-                    session.add(record)
-            for record in bid_table.records:
-                if session.get(Bid, ident=record.BidID) is None:
-                    session.add(record)
-            for record in bidder_table.records:
-                if session.get(Bidder, ident=record.BidderID) is None:
-                    session.add(record)
-            print('   Loading complete')
-            
-            # Update processed to "YES"
-            statement = (
-                update(Abstract).
-                where(Abstract.AbstractID==abstract_id).
-                values(Processed="YES")
-            )
-            session.execute(statement)
-            session.commit()
-            print('   Processing complete')
-
-        except BaseException as error:
-            print(f'{abstract_id}: {error.__class__}: {error}')
-            statement = (
-                update(Abstract).
-                where(Abstract.AbstractID==abstract_id).
-                values(Processed="ERROR")
-            )
-            session.execute(statement)
-            session.commit()
\ No newline at end of file
+def get_processed_abstract_ids(session: Session) -> list:
+    '''Retrieves a list of all Abstract IDs where Processed == "YES"'''
+    statement = select(Abstract.AbstractID).where(Abstract.Processed=='YES')
+    return list(session.execute(statement).scalars())
+
+
+def upgrade_database():
+    '''Creates the tables, columns and indexes added since the database was built, e.g.
+    the Abstract work queue columns, so abstracts load into databases made by earlier
+    versions. A newly created BidAggregate table is backfilled from the bids that were
+    already loaded, and Bid and Contract tables recreated with long bid storage lose
+    their wide columns again.'''
+    backfill = not inspect(engine).has_table(BidAggregate.__tablename__)
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    create_indexes(engine)
+    with engine.begin() as conn:
+        drop_wide_columns(conn)
+    if backfill:
+        from build.aggregate import main as rebuild_aggregates
+        rebuild_aggregates()
+
+
+def process_abstracts(abstract_ids: list = None, limit: int = None, max_workers: int = 8,
+                      rate: float = 4.0, cache: AbstractCache = None, offline: bool = False,
+                      refresh: bool = False, batch_size: int = 50, parse_workers: int = None,
+                      queue_size: int = 32, work_queue: WorkQueue = None) -> PipelineStats:
+    '''Fetches, parses and bulk loads abstracts through the pipeline in batches of
+    batch_size abstracts. Defaults to all unprocessed abstracts, so an interrupted
+    run resumes where its last committed batch left off.
+
+    With refresh set, abstracts are re-downloaded and only those whose payload hash
+    changed are re-parsed and replace their previously loaded records.
+
+    With a work_queue, abstracts are instead claimed from the queue in batches until
+    none are left, so several processes or machines can share one database.'''
+    if work_queue is not None:
+        abstract_ids = []
+    elif abstract_ids is None:
+        with Session() as session:
+            abstract_ids = get_unprocessed_abstract_ids(session)
+    abstract_ids = abstract_ids[:limit]
+    if not abstract_ids and work_queue is None:
+        print('No abstracts to process.')
+        return PipelineStats()
+
+    upgrade_database()
+
+    # Imported here so that runs with nothing to do never load pandas
+    from build.pipeline import Pipeline
+    pipeline = Pipeline(
+        fetch_workers=max_workers,
+        parse_workers=parse_workers,
+        queue_size=queue_size,
+        batch_size=batch_size,
+        rate=rate,
+        cache=cache,
+        offline=offline,
+        refresh=refresh
+    )
+    if work_queue is not None:
+        print(f'Worker {work_queue.worker_id} processing queued abstracts with '
+              f'{pipeline.fetch_workers} fetch and {pipeline.parse_workers} parse workers')
+    else:
+        print(f'Processing {len(abstract_ids)} abstracts with {pipeline.fetch_workers} fetch '
+              f'and {pipeline.parse_workers} parse workers')
+    try:
+        stats = pipeline.run(abstract_ids, work_queue=work_queue)
+    finally:
+        if work_queue is not None:
+            work_queue.release()
+    print(stats)
+
+    return stats
+
+
+def rebuild_from_cache(cache: AbstractCache, max_workers: int = 8, batch_size: int = 50,
+                       parse_workers: int = None):
+    '''Drops and recreates the Contract, Bid, Bidder and BidAggregate tables, and the
+    BidPrice and ContractBidder tables of long bid storage, and reloads every cached
+    abstract without making any network requests. The bid storage mode is kept.
+
+    Every abstract is reset to unprocessed since its rows are dropped, so abstracts
+    that were loaded without the cache are fetched again by the next process run.'''
+    tables = [BidAggregate.__table__, BidPrice.__table__, ContractBidder.__table__, Bid.__table__,
+              Contract.__table__, Bidder.__table__]
+    Base.metadata.drop_all(engine, tables=tables)
+    upgrade_database()
+
+    cached_ids = set(cache.contract_ids())
+    with Session() as session:
+        statement = (
+            update(Abstract).
+            where(Abstract.Processed!='NO').
+            values(Processed='NO', ClaimedBy=None, LeaseExpires=None, Attempts=0, RetryAfter=None)
+        )
+        session.execute(statement)
+        session.commit()
+        uncached_ids = [id for id in get_unprocessed_abstract_ids(session) if id not in cached_ids]
+
+    process_abstracts(sorted(cached_ids), max_workers=max_workers, rate=None,
+                      cache=cache, offline=True, batch_size=batch_size,
+                      parse_workers=parse_workers)
+    if uncached_ids:
+        print(f'{len(uncached_ids)} abstracts are not cached and will be fetched by the next process run.')
+
+
+def main():
+    # The arguments are defined with the other subcommands of the command line interface
+    from cli import main as cli_main
+    cli_main(['process', *sys.argv[1:]])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''Looks up weighted unit prices by ItemID filtered by year, district, county and
+bidder category, or serves the same lookups over local HTTP:
+    GET /prices?item_id=2021501&year=2021&district=Metro&bidder_category=Engineer'''
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from build.aggregate import BIDDER_CATEGORIES
+from data.prices import price_index
+
+
+FILTERS = ['year', 'district', 'county', 'bidder_category']
+
+
+def parse_filters(query: dict) -> dict:
+    '''Converts single-valued query string parameters to weighted_prices arguments.'''
+    filters = {name: query[name][0] for name in FILTERS if query.get(name, [''])[0] != ''}
+    if 'year' in filters:
+        filters['year'] = int(filters['year'])
+    return filters
+
+
+class PriceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_json(self, body, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/prices':
+            self.send_json({'error': 'not found'}, status=404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            item_id = int(query['item_id'][0])
+            filters = parse_filters(query)
+            records = price_index.weighted_prices(item_id, **filters)
+        except (KeyError, ValueError) as error:
+            self.send_json({'error': f'{error.__class__.__name__}: {error}'}, status=400)
+            return
+        self.send_json(list(records))
+
+
+def serve(host: str = '127.0.0.1', port: int = 8080):
+    server = ThreadingHTTPServer((host, port), PriceHandler)
+    server.daemon_threads = True
+    # Load the aggregates before the first request rather than during it
+    price_index.load()
+    print(f'Serving weighted unit prices on http://{host}:{server.server_port}/prices')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up or serve weighted average unit prices.')
+    parser.add_argument('item_id', type=int, nargs='?', help='ItemID to look up')
+    parser.add_argument('--year', type=int, default=None)
+    parser.add_argument('--district', default=None)
+    parser.add_argument('--county', default=None)
+    parser.add_argument('--bidder-category', choices=BIDDER_CATEGORIES, default=None)
+    parser.add_argument('--serve', action='store_true', help='serve lookups over local HTTP instead')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.host, args.port)
+        return
+    if args.item_id is None:
+        parser.error('an item_id is required unless --serve is given')
+
+    records = price_index.weighted_prices(args.item_id, year=args.year, district=args.district,
+                                          county=args.county, bidder_category=args.bidder_category)
+    for record in records:
+        print(f'{record["Year"]} {record["BidderCategory"]}: {record["WeightedUnitPrice"]} '
+              f'({record["ContractOccurrence"]} contracts)')
+    if not records:
+        print(f'No bids found for item {args.item_id}')
+
+
+if __name__ == '__main__':
+    main()
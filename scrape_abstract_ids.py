@@ -1,7 +1,9 @@
+import sys
 from sqlalchemy import select
-from build.scraper import AbstractIDScraper
+from build.scraper import AbstractIDScraper, AbstractIDRequestScraper, abstract_list_url, scrape_years
 from data.model import Abstract, Session
 from datetime import datetime
+from typing import Union
 
 
 current_year = datetime.now().year
@@ -19,9 +21,10 @@ def get_abstract_ids_from_db(session: Session):
     return db_abstract_ids
 
 
-def get_new_abstract_objs(scraper: AbstractIDScraper, db_abstract_ids: list):
+def get_new_abstract_objs(scraper: Union[AbstractIDScraper, AbstractIDRequestScraper], db_abstract_ids: list):
     '''Generates list of new Abstract table objects to be inserted into the database.'''
     abstract_objs = []
+    db_abstract_ids = set(db_abstract_ids)
 
     for scrapped_id in scraper.abstract_ids:
         if scrapped_id not in db_abstract_ids:
@@ -35,31 +38,55 @@ def get_new_abstract_objs(scraper: AbstractIDScraper, db_abstract_ids: list):
     return abstract_objs
 
 
-def scrape_abstract_ids(year: int = current_year):
+def insert_new_abstracts(session: Session, scraper: Union[AbstractIDScraper, AbstractIDRequestScraper],
+                         db_abstract_ids: list) -> int:
+    '''Inserts any scraped abstract IDs that are not already in the database.'''
+    new_abstract_objs = get_new_abstract_objs(scraper, db_abstract_ids)
+    for obj in new_abstract_objs:
+        session.add(obj)
+    return len(new_abstract_objs)
+
+
+def scrape_abstract_ids(year: int = current_year, browser: bool = False):
     '''Scrape abstract IDs for given year and insert into database.'''
     with Session() as session:
         # get a list of all Abstract IDs already in the database
         db_abstract_ids = get_abstract_ids_from_db(session)
 
-        scraper = AbstractIDScraper(year=year)
+        if browser:
+            scraper = AbstractIDScraper(year=year)
+        else:
+            scraper = AbstractIDRequestScraper(year=year)
+
+        # compare scraped ids to list from the database and insert any new abstracts
+        new_count = insert_new_abstracts(session, scraper, db_abstract_ids)
+        session.commit()
+
+    print("Scraping complete.")
+    print(f'Inserted {new_count} new Abstract IDs into the database.')
 
-        # compare scraped ids to list from the database
-        new_abstract_objs = get_new_abstract_objs(scraper, db_abstract_ids)
 
-        # Insert any new abstracts into the database
-        for obj in new_abstract_objs:
-            session.add(obj)
+def scrape_abstract_ids_for_years(years: list, max_workers: int = 4, url: str = abstract_list_url):
+    '''Scrape abstract IDs for several years concurrently and insert into database.'''
+    scrapers = scrape_years(years, max_workers=max_workers, url=url)
 
+    with Session() as session:
+        db_abstract_ids = get_abstract_ids_from_db(session)
+        new_count = 0
+        for scraper in scrapers.values():
+            new_count += insert_new_abstracts(session, scraper, db_abstract_ids)
+            db_abstract_ids.extend(scraper.abstract_ids)
         session.commit()
 
     print("Scraping complete.")
-    print(f'Inserted {len(new_abstract_objs)} new Abstract IDs into the database.')
+    print(f'Inserted {new_count} new Abstract IDs into the database.')
 
 
 def main():
-    # scrape new ids for current year
-    scrape_abstract_ids()
+    # The arguments are defined with the other subcommands of the command line interface
+    from cli import main as cli_main
+    cli_main(['scrape', *sys.argv[1:]])
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()